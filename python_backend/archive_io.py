@@ -0,0 +1,141 @@
+"""
+Archive helpers for the bulk background removal endpoint.
+Reads images one member at a time from a zip or tar upload and writes results
+into a tar stream that can be sent to the client while later images are still
+being processed.
+"""
+
+import io
+import os
+import time
+import tarfile
+import zipfile
+import tempfile
+
+from intake import UploadTooLargeError
+
+# Members with these extensions are treated as images
+IMAGE_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.webp', '.bmp', '.tif', '.tiff', '.gif'}
+
+# Uploads larger than this are spooled to disk instead of memory
+SPOOL_MEMORY_LIMIT = 16 * 1024 * 1024
+
+
+def spool_stream(stream, max_bytes=0, max_memory=SPOOL_MEMORY_LIMIT, chunk_size=1024 * 1024):
+    """Copy a (possibly non-seekable) stream into a seekable spooled temp file.
+
+    Raises UploadTooLargeError as soon as more than max_bytes have been read (0 for no limit).
+    """
+    spooled = tempfile.SpooledTemporaryFile(max_size=max_memory)
+    total = 0
+    while True:
+        chunk = stream.read(chunk_size)
+        if not chunk:
+            break
+        total += len(chunk)
+        if max_bytes and total > max_bytes:
+            spooled.close()
+            raise UploadTooLargeError(f"Archive is larger than the {max_bytes} byte limit")
+        spooled.write(chunk)
+    spooled.seek(0)
+    return spooled
+
+
+def is_image_name(name):
+    return os.path.splitext(name)[1].lower() in IMAGE_EXTENSIONS
+
+
+def unique_output_name(name, extension, used):
+    """Output name for an input: its stem with the output extension, unique among used.
+
+    When another input already took that name (a.jpg and a.png), the source
+    extension is kept in the stem (a_png.png), then a counter is added. The
+    chosen name is added to used.
+    """
+    stem, source_extension = os.path.splitext(name)
+    output = stem + extension
+    if output in used:
+        stem = f"{stem}_{source_extension.lstrip('.').lower()}"
+        output = stem + extension
+        counter = 2
+        while output in used:
+            output = f"{stem}_{counter}{extension}"
+            counter += 1
+    used.add(output)
+    return output
+
+
+def iter_archive_members(fileobj, max_bytes=0):
+    """Yield (name, size, bytes) for each image file in a zip or tar archive.
+
+    Only one member is held in memory at a time. Members whose header size is
+    over max_bytes (0 for no limit) are not decompressed and come back with
+    bytes set to None; the rest are read up to max_bytes + 1 bytes, so a header
+    that understates the size still yields data over the limit. Raises
+    ValueError if the upload is neither a zip nor a tar archive.
+    """
+    limit = max_bytes + 1 if max_bytes else -1
+    if zipfile.is_zipfile(fileobj):
+        fileobj.seek(0)
+        with zipfile.ZipFile(fileobj) as archive:
+            for info in archive.infolist():
+                if info.is_dir() or not is_image_name(info.filename):
+                    continue
+                if max_bytes and info.file_size > max_bytes:
+                    yield info.filename, info.file_size, None
+                    continue
+                with archive.open(info) as member:
+                    yield info.filename, info.file_size, member.read(limit)
+        return
+
+    fileobj.seek(0)
+    try:
+        archive = tarfile.open(fileobj=fileobj, mode='r:*')
+    except tarfile.TarError:
+        raise ValueError("Upload is not a zip or tar archive")
+
+    with archive:
+        for member in archive:
+            if not member.isfile() or not is_image_name(member.name):
+                continue
+            if max_bytes and member.size > max_bytes:
+                yield member.name, member.size, None
+                continue
+            extracted = archive.extractfile(member)
+            if extracted is not None:
+                yield member.name, member.size, extracted.read(limit)
+
+
+class _ChunkSink:
+    """Write-only file object that collects bytes until they are drained"""
+
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def drain(self):
+        chunks, self.chunks = self.chunks, []
+        return chunks
+
+
+class TarStreamWriter:
+    """Build an uncompressed tar incrementally; drain() returns bytes ready to send"""
+
+    def __init__(self):
+        self._sink = _ChunkSink()
+        self._tar = tarfile.open(fileobj=self._sink, mode='w|')
+
+    def add(self, name, data):
+        info = tarfile.TarInfo(name)
+        info.size = len(data)
+        info.mtime = int(time.time())
+        self._tar.addfile(info, io.BytesIO(data))
+
+    def close(self):
+        self._tar.close()
+
+    def drain(self):
+        return self._sink.drain()
@@ -0,0 +1,192 @@
+#!/usr/bin/env python
+"""
+Offline batch background removal without the Flask server.
+Decoding and preprocessing run in DataLoader worker processes, inference runs
+in batches in the main process, and compositing/encoding/writing runs on a
+separate process pool, so the CPU never sits idle waiting on disk or PNG
+compression. Outputs that already exist are skipped, so an interrupted run can
+simply be started again.
+
+Usage:
+    python batch_remove.py INPUT_DIR OUTPUT_DIR [--batch-size 8] [--decode-workers 4] [--encode-workers 4]
+"""
+
+import os
+import sys
+import time
+import logging
+import argparse
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from PIL import Image
+
+from archive_io import IMAGE_EXTENSIONS, unique_output_name
+from compositing import compose_cutout
+
+# Set up logging to console
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    handlers=[
+        logging.StreamHandler(sys.stdout)
+    ]
+)
+logger = logging.getLogger('batch-remove')
+
+OUTPUT_EXTENSIONS = {'png': '.png', 'webp': '.webp'}
+
+# fp32 models plus the int8 variants created by quantize_model.py
+MODEL_CHOICES = [name + suffix for name in ('u2net', 'u2net_portrait', 'u2netp')
+                 for suffix in ('', '_int8_dynamic', '_int8_static')]
+
+
+def find_images(input_dir, recursive=True):
+    """List image files under input_dir, sorted for a stable processing order"""
+    paths = []
+    for root, dirs, files in os.walk(input_dir):
+        dirs.sort()
+        for name in sorted(files):
+            if os.path.splitext(name)[1].lower() in IMAGE_EXTENSIONS:
+                paths.append(os.path.join(root, name))
+        if not recursive:
+            break
+    return paths
+
+
+def output_paths(paths, input_dir, output_dir, output_format):
+    """Mirror the input tree under output_dir with the output extension, one distinct output per input.
+
+    paths must come in a stable order (see find_images) so a resumed run picks the same names.
+    """
+    used = set()
+    return [os.path.join(output_dir, unique_output_name(os.path.relpath(path, input_dir),
+                                                        OUTPUT_EXTENSIONS[output_format], used))
+            for path in paths]
+
+
+def encode_and_write(src_path, dst_path, mask_np, output_format):
+    """Composite the cutout at full resolution and write it (runs in the encode pool)"""
+    image = Image.open(src_path)
+    if image.mode != 'RGB':
+        image = image.convert('RGB')
+
+    mask = Image.fromarray(mask_np).resize(image.size, Image.BILINEAR)
+    result = compose_cutout(image, mask)
+
+    os.makedirs(os.path.dirname(dst_path), exist_ok=True)
+    # Write to a temp name first so a crash never leaves a file that a resumed run would skip
+    tmp_path = dst_path + '.partial'
+    result.save(tmp_path, format=output_format.upper())
+    os.replace(tmp_path, dst_path)
+    return dst_path
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Batch background removal over a directory')
+    parser.add_argument('input_dir', help='Directory of input images')
+    parser.add_argument('output_dir', help='Directory to write cutouts to (mirrors the input tree)')
+    parser.add_argument('--model', type=str, default='u2net', choices=MODEL_CHOICES,
+                        help='Model to use for background removal')
+    parser.add_argument('--backend', type=str, default='eager', choices=['eager', 'torchscript', 'inductor', 'onnxruntime'],
+                        help='Inference backend')
+    parser.add_argument('--fuse', action='store_true',
+                        help='Fold BatchNorm and input normalization into the convolutions')
+    parser.add_argument('--batch-size', type=int, default=8, help='Images per forward pass')
+    parser.add_argument('--decode-workers', type=int, default=max(1, (os.cpu_count() or 2) // 2),
+                        help='DataLoader worker processes for decoding and preprocessing')
+    parser.add_argument('--encode-workers', type=int, default=max(1, (os.cpu_count() or 2) // 2),
+                        help='Processes for compositing, encoding and writing outputs')
+    parser.add_argument('--format', type=str, default='png', choices=sorted(OUTPUT_EXTENSIONS),
+                        help='Output image format')
+    parser.add_argument('--no-recursive', action='store_true', help='Only process the top-level directory')
+    parser.add_argument('--overwrite', action='store_true',
+                        help='Reprocess images whose output already exists instead of resuming')
+    args = parser.parse_args()
+
+    paths = find_images(args.input_dir, recursive=not args.no_recursive)
+    outputs = output_paths(paths, args.input_dir, args.output_dir, args.format)
+    if not args.overwrite:
+        todo = [(p, o) for p, o in zip(paths, outputs) if not os.path.exists(o)]
+        logger.info(f"Found {len(paths)} images, {len(paths) - len(todo)} already done")
+    else:
+        todo = list(zip(paths, outputs))
+        logger.info(f"Found {len(paths)} images")
+    if not todo:
+        return 0
+
+    # Fork the encode processes now, before torch is imported and spins up its thread
+    # pools; the executor only starts them on the first submit, so submit no-ops and wait
+    encode_pool = ProcessPoolExecutor(max_workers=args.encode_workers)
+    for future in [encode_pool.submit(int) for _ in range(args.encode_workers)]:
+        future.result()
+
+    import torch
+    from torch.utils.data import DataLoader
+    from data_loader import ImageFolderDataset
+    from inference import CustomRescale, load_model, compile_model, run_model, prediction_to_numpy
+
+    net = load_model(args.model)
+    if net is None:
+        logger.error("Failed to load model. Exiting.")
+        return 1
+    raw_input = args.fuse and isinstance(net, torch.nn.Module)
+    if raw_input:
+        from model.fusion import fuse_model
+        net = fuse_model(net)
+    net = compile_model(net, args.model, args.backend)
+
+    dataset = ImageFolderDataset([p for p, _ in todo], CustomRescale(320, normalize=not raw_input))
+    loader = DataLoader(dataset, batch_size=args.batch_size, shuffle=False,
+                        num_workers=args.decode_workers, pin_memory=torch.cuda.is_available(),
+                        prefetch_factor=2 if args.decode_workers > 0 else None)
+
+    # Bound the number of pending writes so masks don't pile up in memory
+    pending = deque()
+    max_pending = args.encode_workers * 4
+    inferred, done, failed = 0, 0, 0
+    start = time.perf_counter()
+
+    def collect(future):
+        nonlocal done, failed
+        try:
+            future.result()
+            done += 1
+        except Exception as e:
+            logger.error(f"Error writing output: {e}")
+            failed += 1
+
+    try:
+        for batch in loader:
+            preds = run_model(net, batch['image'])
+            for idx, ok, pred in zip(batch['idx'].tolist(), batch['ok'].tolist(), preds):
+                src_path, dst_path = todo[idx]
+                if not ok:
+                    logger.error(f"Could not decode {src_path}, skipping")
+                    failed += 1
+                    continue
+                mask_np = (prediction_to_numpy(pred) * 255).astype(np.uint8)
+                inferred += 1
+                pending.append(encode_pool.submit(encode_and_write, src_path, dst_path, mask_np, args.format))
+
+            while len(pending) > max_pending:
+                collect(pending.popleft())
+
+            elapsed = time.perf_counter() - start
+            logger.info(f"Inferred {inferred}/{len(todo)} ({inferred / elapsed:.1f} images/s), "
+                        f"{done} written")
+
+        while pending:
+            collect(pending.popleft())
+    finally:
+        encode_pool.shutdown(wait=True, cancel_futures=True)
+
+    elapsed = time.perf_counter() - start
+    logger.info(f"Finished: {done} written, {failed} failed in {elapsed:.1f}s "
+                f"({done / elapsed if elapsed else 0:.2f} images/s)")
+    return 0 if failed == 0 else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,137 @@
+"""
+Dynamic micro-batching for U-2-Net inference.
+Request threads submit single preprocessed tensors; a background thread
+collects them for up to a short wait window (or until the batch is full),
+runs one forward pass and hands each request its own slice of the output.
+"""
+
+import queue
+import threading
+import time
+import logging
+from concurrent.futures import Future
+
+import torch
+
+logger = logging.getLogger('u2net-server')
+
+
+class InferenceBatcher:
+    """Background scheduler that groups concurrent inference requests"""
+
+    def __init__(self, forward, max_batch_size=8, max_wait_ms=5.0):
+        # forward takes a (N, C, H, W) batch and returns a (N, ...) tensor
+        self.forward = forward
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self._queue = queue.Queue()
+        self._thread = None
+        self._stopped = threading.Event()
+        self._lock = threading.Lock()
+        self._inputs = None  # Batch buffer reused by the worker thread
+        self.batches_run = 0
+        self.items_run = 0
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._run, name='inference-batcher', daemon=True)
+        self._thread.start()
+        logger.info(f"Inference batcher started (max batch {self.max_batch_size}, "
+                    f"wait {self.max_wait * 1000:.1f} ms)")
+
+    def stop(self):
+        if self._thread is None:
+            return
+        self._stopped.set()
+        self._queue.put(None)  # Wake the worker up
+        self._thread.join()
+        self._thread = None
+
+    def submit(self, tensor):
+        """Queue a single (C, H, W) tensor and return a Future for its output"""
+        if self._thread is None:
+            raise RuntimeError("Inference batcher is not running")
+        future = Future()
+        self._queue.put((tensor, future))
+        return future
+
+    def predict(self, tensor, timeout=None):
+        """Blocking helper: submit a tensor and wait for its output slice"""
+        return self.submit(tensor).result(timeout=timeout)
+
+    def pending(self):
+        return self._queue.qsize()
+
+    def stats(self):
+        with self._lock:
+            batches, items = self.batches_run, self.items_run
+        return {
+            'max_batch_size': self.max_batch_size,
+            'max_wait_ms': self.max_wait * 1000,
+            'batches_run': batches,
+            'items_run': items,
+            'mean_batch_size': items / batches if batches else 0.0,
+            'pending': self.pending(),
+        }
+
+    def _collect(self):
+        """Block for the first item, then gather more until the window closes"""
+        first = self._queue.get()
+        if first is None:
+            return []
+        batch = [first]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                item = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if item is None:
+                break
+            batch.append(item)
+        return batch
+
+    def _stack(self, tensors):
+        """Stack tensors into the reusable batch buffer (only the worker thread calls this)"""
+        shape = (self.max_batch_size,) + tuple(tensors[0].shape)
+        if self._inputs is None or self._inputs.shape != shape or self._inputs.dtype != tensors[0].dtype:
+            self._inputs = torch.empty(shape, dtype=tensors[0].dtype)
+        return torch.stack(tensors, out=self._inputs[:len(tensors)])
+
+    def _run(self):
+        while not self._stopped.is_set():
+            batch = self._collect()
+            # Skip requests whose callers already gave up
+            batch = [(t, f) for t, f in batch if f.set_running_or_notify_cancel()]
+            if not batch:
+                continue
+
+            try:
+                inputs = self._stack([t for t, _ in batch])
+                outputs = self.forward(inputs)
+            except Exception as e:
+                logger.error(f"Batched inference failed: {e}")
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+
+            with self._lock:
+                self.batches_run += 1
+                self.items_run += len(batch)
+
+            for i, (_, future) in enumerate(batch):
+                future.set_result(outputs[i])
+
+        # Fail anything still queued so callers don't hang
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is not None:
+                item[1].set_exception(RuntimeError("Inference batcher stopped"))
@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+"""
+Benchmark the mask compositing stage of process_image.
+Compares the old per-pixel getpixel/putpixel loop against the vectorized
+compose_cutout at 1, 4 and 12 megapixels.
+
+Usage:
+    python benchmarks/compositing_benchmark.py [--sizes 1 4 12] [--repeat 3]
+"""
+
+import os
+import sys
+import time
+import argparse
+import numpy as np
+from PIL import Image
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from compositing import compose_cutout, MASK_THRESHOLD
+
+
+def reference_composite(image, mask):
+    """The original per-pixel loop from process_image, kept for comparison"""
+    result = Image.new('RGBA', (image.width, image.height), (0, 0, 0, 0))
+    image = image.convert('RGBA')
+    mask_np = np.array(mask)
+    for y in range(image.height):
+        for x in range(image.width):
+            r, g, b, a = image.getpixel((x, y))
+            if mask_np[y, x] > MASK_THRESHOLD:
+                result.putpixel((x, y), (r, g, b, 255))
+    return result
+
+
+def make_inputs(megapixels, seed=0):
+    """Create a random RGB image and a blob-shaped mask with a 4:3 aspect ratio"""
+    width = int(round((megapixels * 1e6 * 4 / 3) ** 0.5))
+    height = int(round(megapixels * 1e6 / width))
+    rng = np.random.default_rng(seed)
+
+    image = Image.fromarray(rng.integers(0, 256, (height, width, 3), dtype=np.uint8), 'RGB')
+
+    # Upsample a low-res random field so the mask has large connected regions
+    field = rng.integers(0, 256, (32, 32), dtype=np.uint8)
+    mask = Image.fromarray(field).resize((width, height), Image.BILINEAR)
+    return image, mask
+
+
+def time_call(func, repeat):
+    """Return the best wall time over `repeat` runs and the last result"""
+    best = float('inf')
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark mask compositing')
+    parser.add_argument('--sizes', type=float, nargs='+', default=[1, 4, 12],
+                        help='Image sizes in megapixels')
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='Timing repetitions for the vectorized path (best is reported)')
+    parser.add_argument('--skip-reference', action='store_true',
+                        help='Only time the vectorized path')
+    args = parser.parse_args()
+
+    print(f"{'size':>8} {'resolution':>12} {'loop (s)':>10} {'numpy (s)':>10} {'speedup':>9}")
+    for megapixels in args.sizes:
+        image, mask = make_inputs(megapixels)
+        vectorized, fast_result = time_call(lambda: compose_cutout(image, mask), args.repeat)
+
+        if args.skip_reference:
+            loop, speedup = float('nan'), float('nan')
+        else:
+            # The loop is slow enough that a single run is representative
+            loop, loop_result = time_call(lambda: reference_composite(image, mask), 1)
+            speedup = loop / vectorized
+            if fast_result.tobytes() != loop_result.tobytes():
+                print(f"WARNING: outputs differ at {megapixels} MP")
+
+        print(f"{megapixels:>6g}MP {image.width:>5}x{image.height:<6} "
+              f"{loop:>10.3f} {vectorized:>10.4f} {speedup:>8.0f}x")
+
+
+if __name__ == '__main__':
+    main()
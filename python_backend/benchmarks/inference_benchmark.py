@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+"""
+Benchmark the full U2NET forward against the inference-only predict path.
+forward() computes and upsamples all seven side outputs; predict('d0') only
+builds the fused prediction the server uses, and predict('d1') stops after the
+first side output. Each mode runs in a fresh process so the peak-memory
+numbers don't include allocations made by the other modes.
+
+Usage:
+    python benchmarks/inference_benchmark.py [--model u2net|u2netp] [--batch-size 1] [--repeat 5]
+"""
+
+import os
+import sys
+import time
+import argparse
+import resource
+import multiprocessing
+
+import torch
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from model import U2NET, U2NETP
+
+MODES = ('forward', 'predict-d0', 'predict-d1')
+
+
+def peak_rss():
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def run_mode(mode, model_name, batch_size, repeat, threads):
+    """Time one mode and measure the peak memory of its first forward pass"""
+    if threads > 0:
+        torch.set_num_threads(threads)
+    device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+    net = (U2NET if model_name == 'u2net' else U2NETP)(3, 1).to(device).eval()
+    inputs = torch.rand(batch_size, 3, 320, 320, device=device)
+
+    if mode == 'forward':
+        call = lambda: net(inputs)
+    else:
+        call = lambda: net.predict(inputs, output=mode.split('-')[1])
+
+    with torch.no_grad():
+        if device.type == 'cuda':
+            torch.cuda.reset_peak_memory_stats()
+            baseline = torch.cuda.memory_allocated()
+        else:
+            baseline = peak_rss()
+        call()
+        if device.type == 'cuda':
+            torch.cuda.synchronize()
+            peak = torch.cuda.max_memory_allocated() - baseline
+        else:
+            peak = peak_rss() - baseline
+
+        times = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            call()
+            if device.type == 'cuda':
+                torch.cuda.synchronize()
+            times.append(time.perf_counter() - start)
+
+    return {'mode': mode, 'seconds': sorted(times)[len(times) // 2], 'peak_bytes': peak}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark forward() against the inference-only predict()')
+    parser.add_argument('--model', type=str, default='u2net', choices=['u2net', 'u2netp'])
+    parser.add_argument('--batch-size', type=int, default=1)
+    parser.add_argument('--repeat', type=int, default=5, help='Timed runs per mode (median is reported)')
+    parser.add_argument('--threads', type=int, default=0, help='torch threads (0 keeps the default)')
+    args = parser.parse_args()
+
+    context = multiprocessing.get_context('spawn')
+    results = []
+    for mode in MODES:
+        with context.Pool(1) as pool:
+            results.append(pool.apply(run_mode, (mode, args.model, args.batch_size, args.repeat, args.threads)))
+
+    base = results[0]
+    print(f"{args.model}, batch {args.batch_size}, {'cuda' if torch.cuda.is_available() else 'cpu'}")
+    print(f"{'mode':<12} {'latency':>10} {'speedup':>8} {'peak memory':>12} {'saved':>10}")
+    for result in results:
+        print(f"{result['mode']:<12} {result['seconds'] * 1000:>8.1f}ms "
+              f"{base['seconds'] / result['seconds']:>7.2f}x "
+              f"{result['peak_bytes'] / (1024 * 1024):>10.1f}MB "
+              f"{(base['peak_bytes'] - result['peak_bytes']) / (1024 * 1024):>8.1f}MB")
+
+
+if __name__ == '__main__':
+    main()
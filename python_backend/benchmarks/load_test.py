@@ -0,0 +1,295 @@
+#!/usr/bin/env python
+"""
+Load generator for a running server.
+Drives /remove-background and /customize-product (or their /binary variants)
+with a weighted mix of endpoints and image sizes from a fixed number of
+concurrent clients, then reports throughput, latency percentiles and error
+rates per endpoint and size, together with the server's RSS over the run
+(sampled from /workers).
+
+Without --rate every client sends its next request as soon as the previous
+one returns (closed loop). With --rate the clients follow a shared schedule;
+latency is then measured from each request's scheduled start, so time spent
+waiting for a free client counts against the server instead of being hidden.
+
+Every upload carries a unique JPEG comment, so each request misses the
+server's result cache while the pixels (and the work) stay the same.
+
+Usage:
+    python benchmarks/load_test.py [--url http://localhost:5000] [--concurrency 4] [--duration 60]
+                                   [--rate 2] [--mix remove=3,customize=1] [--sizes 0.3=2,2=1,12=0.2]
+                                   [--binary] [--output results.json]
+"""
+
+import sys
+import json
+import math
+import time
+import base64
+import random
+import argparse
+import threading
+import urllib.error
+import urllib.request
+
+from synthetic_images import make_image
+
+ENDPOINTS = {
+    # name: (JSON path, binary path)
+    'remove': ('/remove-background', '/remove-background/binary'),
+    'customize': ('/customize-product', '/customize-product/binary?background=white'),
+}
+
+
+def parse_weights(value, convert=str):
+    """Parse 'a=3,b=1' into [(a, 3.0), (b, 1.0)]; a bare key gets weight 1"""
+    weights = []
+    for item in value.split(','):
+        key, _, weight = item.partition('=')
+        weights.append((convert(key.strip()), float(weight) if weight else 1.0))
+    return weights
+
+
+def unique_jpeg(data, tag):
+    """The same JPEG with a comment segment holding tag, so its bytes (and cache key) differ"""
+    comment = f"load-test {tag}".encode('ascii')
+    return data[:2] + b'\xff\xfe' + (len(comment) + 2).to_bytes(2, 'big') + comment + data[2:]
+
+
+def percentile(values, fraction):
+    """Nearest-rank percentile of an already sorted list"""
+    if not values:
+        return None
+    return values[max(0, math.ceil(fraction * len(values)) - 1)]
+
+
+class LoadTest:
+    """Shared state of one run: the request schedule, results and RSS samples"""
+
+    def __init__(self, url, inputs, cutouts, mix, sizes, binary, rate, timeout, seed):
+        self.url = url.rstrip('/')
+        self.inputs = inputs
+        self.cutouts = cutouts
+        self.mix = mix
+        self.sizes = sizes
+        self.binary = binary
+        self.rate = rate
+        self.timeout = timeout
+        self.results = []
+        self.rss = []
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._sent = 0
+        self._start = None
+
+    def request(self, endpoint, size, number):
+        """Build the urllib request for one call"""
+        path = ENDPOINTS[endpoint][1 if self.binary else 0]
+        data = unique_jpeg(self.inputs[size], number) if endpoint == 'remove' else self.cutouts[size]
+        if self.binary:
+            content_type = 'image/jpeg' if endpoint == 'remove' else 'image/png'
+            body = data
+        else:
+            mime = 'jpeg' if endpoint == 'remove' else 'png'
+            payload = {'image': f"data:image/{mime};base64," + base64.b64encode(data).decode('utf-8')}
+            if endpoint == 'customize':
+                payload['background'] = 'white'
+            content_type = 'application/json'
+            body = json.dumps(payload).encode('utf-8')
+        return urllib.request.Request(self.url + path, data=body, method='POST',
+                                      headers={'Content-Type': content_type})
+
+    def send(self, endpoint, size, number):
+        """Send one request; returns (status, error message or None, response bytes)"""
+        try:
+            with urllib.request.urlopen(self.request(endpoint, size, number), timeout=self.timeout) as response:
+                body = response.read()
+                return response.status, None, len(body)
+        except urllib.error.HTTPError as e:
+            return e.code, e.read()[:200].decode('utf-8', 'replace'), 0
+        except (urllib.error.URLError, OSError) as e:
+            return None, str(getattr(e, 'reason', e)), 0
+
+    def next_request(self, deadline, limit):
+        """Pick the next (endpoint, size, request number, scheduled start), or None when the run is over"""
+        with self._lock:
+            if limit and self._sent >= limit:
+                return None
+            scheduled = self._start + self._sent / self.rate if self.rate else time.perf_counter()
+            if scheduled >= deadline:
+                return None
+            number = self._sent
+            self._sent += 1
+            endpoint = self._random.choices([e for e, _ in self.mix], [w for _, w in self.mix])[0]
+            size = self._random.choices([s for s, _ in self.sizes], [w for _, w in self.sizes])[0]
+        return endpoint, size, number, scheduled
+
+    def client(self, deadline, limit):
+        while True:
+            task = self.next_request(deadline, limit)
+            if task is None:
+                return
+            endpoint, size, number, scheduled = task
+            delay = scheduled - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            start = scheduled if self.rate else time.perf_counter()
+            status, error, length = self.send(endpoint, size, number)
+            finished = time.perf_counter()
+            with self._lock:
+                self.results.append({'endpoint': endpoint, 'size': size, 'status': status, 'error': error,
+                                     'bytes': length, 'start': start - self._start,
+                                     'latency': finished - start})
+
+    def sample_rss(self, stop, interval):
+        """Record the summed RSS of the server's worker processes until stop is set"""
+        while not stop.is_set():
+            try:
+                with urllib.request.urlopen(self.url + '/workers', timeout=5) as response:
+                    info = json.load(response)
+                workers = [w['rss'] for w in info['workers'] if w.get('rss') is not None]
+                self.rss.append({'time': round(time.perf_counter() - self._start, 3),
+                                 'rss': sum(workers), 'workers': workers})
+            except (urllib.error.URLError, OSError, ValueError, KeyError):
+                pass
+            stop.wait(interval)
+
+    def run(self, concurrency, duration, limit, rss_interval):
+        self._start = time.perf_counter()
+        deadline = self._start + duration if duration else float('inf')
+        stop = threading.Event()
+        sampler = None
+        if rss_interval > 0:
+            sampler = threading.Thread(target=self.sample_rss, args=(stop, rss_interval), daemon=True)
+            sampler.start()
+        clients = [threading.Thread(target=self.client, args=(deadline, limit), daemon=True)
+                   for _ in range(concurrency)]
+        for thread in clients:
+            thread.start()
+        for thread in clients:
+            thread.join()
+        elapsed = time.perf_counter() - self._start
+        stop.set()
+        if sampler is not None:
+            sampler.join()
+        return elapsed
+
+
+def summarize(results, elapsed):
+    """Throughput, latency percentiles (ms) and errors for a list of results"""
+    ok = sorted(r['latency'] for r in results if r['status'] == 200)
+    errors = {}
+    for r in results:
+        if r['status'] != 200:
+            key = str(r['status'] or 'connection')
+            errors[key] = errors.get(key, 0) + 1
+    ms = lambda value: None if value is None else round(value * 1000, 1)
+    return {
+        'requests': len(results),
+        'throughput': round(len(ok) / elapsed, 3) if elapsed else 0.0,
+        'error_rate': round(1 - len(ok) / len(results), 4) if results else 0.0,
+        'errors': errors,
+        'p50_ms': ms(percentile(ok, 0.50)),
+        'p95_ms': ms(percentile(ok, 0.95)),
+        'p99_ms': ms(percentile(ok, 0.99)),
+        'max_ms': ms(ok[-1] if ok else None),
+    }
+
+
+def print_report(report):
+    def line(name, s):
+        def fmt(value):
+            return '-' if value is None else f"{value:.0f}"
+        print(f"{name:<22} {s['requests']:>6} {s['throughput']:>7.2f} {fmt(s['p50_ms']):>8} {fmt(s['p95_ms']):>8} "
+              f"{fmt(s['p99_ms']):>8} {fmt(s['max_ms']):>8} {s['error_rate']:>7.1%}")
+
+    print(f"\n{'':<22} {'reqs':>6} {'req/s':>7} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'max ms':>8} {'errors':>7}")
+    line('total', report['total'])
+    for name, summary in report['by_case'].items():
+        line(name, summary)
+    if report['total']['errors']:
+        print(f"errors by status: {report['total']['errors']}")
+
+    rss = report['rss']
+    if rss:
+        mb = lambda value: value / (1024 * 1024)
+        peak = max(sample['rss'] for sample in rss)
+        print(f"\nserver RSS: start {mb(rss[0]['rss']):.0f} MB, peak {mb(peak):.0f} MB, end {mb(rss[-1]['rss']):.0f} MB")
+        # About ten evenly spaced samples show the trend without flooding the terminal
+        for sample in rss[::max(1, len(rss) // 10)]:
+            print(f"  t={sample['time']:>7.1f}s  {mb(sample['rss']):>7.0f} MB  "
+                  f"({', '.join(f'{mb(w):.0f}' for w in sample['workers'])})")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Load test the background removal server')
+    parser.add_argument('--url', type=str, default='http://localhost:5000', help='Server base URL')
+    parser.add_argument('--concurrency', type=int, default=4, help='Concurrent clients')
+    parser.add_argument('--duration', type=float, default=60, help='Seconds to send requests (0 = use --requests)')
+    parser.add_argument('--requests', type=int, default=0, help='Stop after this many requests (0 = no limit)')
+    parser.add_argument('--rate', type=float, default=0,
+                        help='Target requests per second over all clients (0 = closed loop, as fast as possible)')
+    parser.add_argument('--mix', type=str, default='remove=3,customize=1',
+                        help=f"Endpoint weights, from {', '.join(ENDPOINTS)}")
+    parser.add_argument('--sizes', type=str, default='0.3=2,2=1,12=0.2',
+                        help='Image sizes in megapixels with their weights')
+    parser.add_argument('--binary', action='store_true', help='Use the /binary endpoints instead of JSON/base64')
+    parser.add_argument('--timeout', type=float, default=120, help='Per-request timeout in seconds')
+    parser.add_argument('--rss-interval', type=float, default=1.0,
+                        help='Seconds between server RSS samples (0 disables)')
+    parser.add_argument('--seed', type=int, default=0, help='Seed for the request mix')
+    parser.add_argument('--output', type=str, default=None, help='Write the report and every request as JSON')
+    args = parser.parse_args()
+
+    try:
+        mix = parse_weights(args.mix)
+        sizes = parse_weights(args.sizes, float)
+    except ValueError:
+        parser.error('--mix and --sizes take name=weight pairs separated by commas')
+    unknown = [name for name, _ in mix if name not in ENDPOINTS]
+    if unknown:
+        parser.error(f"Unknown endpoint(s) in --mix: {', '.join(unknown)}")
+    if not args.duration and not args.requests:
+        parser.error('Give --duration or --requests')
+
+    inputs = {size: make_image(size, seed=i) for i, size in enumerate(s for s, _ in sizes)}
+    test = LoadTest(args.url, inputs, {}, mix, sizes, args.binary, args.rate, args.timeout, args.seed)
+
+    # customize-product is sent the cutouts the server produces, as the frontend does;
+    # fetching them also warms the server up before the measured run
+    for size, data in inputs.items():
+        request = urllib.request.Request(args.url.rstrip('/') + ENDPOINTS['remove'][1], data=data,
+                                         method='POST', headers={'Content-Type': 'image/jpeg'})
+        try:
+            with urllib.request.urlopen(request, timeout=args.timeout) as response:
+                test.cutouts[size] = response.read()
+        except (urllib.error.URLError, OSError) as e:
+            print(f"Server at {args.url} did not process a {size:g} MP image: {e}")
+            return 1
+
+    print(f"{args.concurrency} clients, {'%g req/s' % args.rate if args.rate else 'closed loop'}, "
+          f"{'%gs' % args.duration if args.duration else '%d requests' % args.requests}, "
+          f"{'binary' if args.binary else 'JSON'} endpoints", flush=True)
+    elapsed = test.run(args.concurrency, args.duration, args.requests, args.rss_interval)
+
+    cases = {}
+    for result in test.results:
+        cases.setdefault(f"{result['endpoint']}/{result['size']:g}mp", []).append(result)
+    report = {
+        'settings': {k: v for k, v in vars(args).items() if k != 'output'},
+        'elapsed': round(elapsed, 3),
+        'total': summarize(test.results, elapsed),
+        'by_case': {name: summarize(results, elapsed) for name, results in sorted(cases.items())},
+        'rss': test.rss,
+    }
+    print_report(report)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({**report, 'requests': test.results}, f, indent=2)
+        print(f"\nWrote {args.output}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
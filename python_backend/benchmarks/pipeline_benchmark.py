@@ -0,0 +1,197 @@
+#!/usr/bin/env python
+"""
+Benchmark suite for the background removal pipeline.
+Times process_image, apply_background and the main endpoint handlers (through
+the Flask test client) for U2NET and U2NETP on synthetic JPEGs at several
+resolutions, with a per-stage breakdown taken from the server's own stage
+timers. Inputs come from synthetic_images.py and models use seeded random
+weights, so nothing needs downloading and runs are comparable across
+machines of the same kind.
+
+Results are written as JSON; pass a previous result as --baseline to fail
+(exit code 1) when any case is slower than the baseline by more than
+--threshold.
+
+Usage:
+    python benchmarks/pipeline_benchmark.py [--models u2net u2netp] [--sizes 0.3 2 12] [--repeat 3]
+                                            [--output results.json] [--baseline baseline.json] [--threshold 0.15]
+"""
+
+import io
+import os
+import sys
+import json
+import time
+import base64
+import platform
+import argparse
+
+import numpy as np
+import torch
+from PIL import Image
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import simplified_u2net_server as server
+from inference import MODEL_ARCHITECTURES
+from synthetic_images import make_image
+
+# Endpoint cases: (name, path, upload). customize-product composites an
+# existing cutout, so it is sent the PNG that process_image produced
+ENDPOINTS = (
+    ('remove-binary', '/remove-background/binary', 'jpeg'),
+    ('remove-json', '/remove-background', 'json'),
+    ('mask-binary', '/remove-background/binary?output=mask', 'jpeg'),
+    ('customize-binary', '/customize-product/binary?background=white', 'cutout'),
+)
+
+
+def stage_totals():
+    """{stage: (seconds, count)} accumulated so far by the server's stage timers"""
+    totals = {}
+    for suffix, labels, value in server.STAGE_SECONDS.samples():
+        if suffix in ('_sum', '_count'):
+            seconds, count = totals.get(labels['stage'], (0.0, 0))
+            totals[labels['stage']] = (value, count) if suffix == '_sum' else (seconds, value)
+    return totals
+
+
+def run_case(func, repeat):
+    """Time func after one warmup call; median/min wall time and mean time per stage"""
+    func()
+    before = stage_totals()
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+
+    stages = {}
+    for stage, (seconds, count) in stage_totals().items():
+        seconds -= before.get(stage, (0.0, 0))[0]
+        if count - before.get(stage, (0.0, 0))[1]:
+            stages[stage] = round(seconds * 1000 / repeat, 3)
+    return {'median_ms': round(sorted(times)[len(times) // 2] * 1000, 3),
+            'min_ms': round(min(times) * 1000, 3),
+            'stages_ms': stages}
+
+
+def endpoint_call(client, path, upload, data, cutout):
+    if upload == 'json':
+        payload = {'image': base64.b64encode(data).decode('utf-8')}
+        call = lambda: client.post(path, json=payload)
+    elif upload == 'cutout':
+        call = lambda: client.post(path, data=cutout, content_type='image/png')
+    else:
+        call = lambda: client.post(path, data=data, content_type='image/jpeg')
+
+    def run():
+        response = call()
+        if response.status_code != 200:
+            raise RuntimeError(f"{path} returned {response.status_code}: {response.get_data(as_text=True)[:200]}")
+        response.get_data()
+    return run
+
+
+def compare(results, baseline, threshold):
+    """Print the change per case against the baseline and return the regressed case names"""
+    regressions = []
+    print(f"\n{'case':<36} {'baseline':>10} {'current':>10} {'change':>8}")
+    for name, result in results['cases'].items():
+        reference = baseline['cases'].get(name)
+        if reference is None:
+            continue
+        change = result['median_ms'] / reference['median_ms'] - 1
+        flag = ''
+        if change > threshold:
+            regressions.append(name)
+            flag = '  REGRESSION'
+        print(f"{name:<36} {reference['median_ms']:>8.1f}ms {result['median_ms']:>8.1f}ms {change:>+7.1%}{flag}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the background removal pipeline')
+    parser.add_argument('--models', type=str, nargs='+', default=['u2net', 'u2netp'], choices=['u2net', 'u2netp'])
+    parser.add_argument('--sizes', type=float, nargs='+', default=[0.3, 2, 12], help='Image sizes in megapixels')
+    parser.add_argument('--repeat', type=int, default=3, help='Timed runs per case, after one warmup run')
+    parser.add_argument('--threads', type=int, default=0, help='torch threads (0 keeps the default)')
+    parser.add_argument('--output', type=str, default=None, help='Write the results as JSON to this path')
+    parser.add_argument('--baseline', type=str, default=None, help='Earlier results to compare against')
+    parser.add_argument('--threshold', type=float, default=0.15,
+                        help='Relative slowdown of a case median that counts as a regression')
+    args = parser.parse_args()
+
+    if args.threads > 0:
+        torch.set_num_threads(args.threads)
+
+    # Every run must do the full work: no result cache, mask store or job threads
+    server.args.cache_size_mb = 0
+    server.args.mask_store_mb = 0
+    server.args.job_queue_size = 0
+    server.args.warmup = 1
+    client = server.app.test_client()
+    inputs = {size: make_image(size, seed=i) for i, size in enumerate(args.sizes)}
+
+    results = {
+        'environment': {
+            'python': platform.python_version(),
+            'torch': torch.__version__,
+            'machine': platform.machine(),
+            'processor': platform.processor(),
+            'cpu_count': os.cpu_count(),
+            'torch_threads': torch.get_num_threads(),
+            'cuda': torch.cuda.is_available(),
+        },
+        'settings': {'models': args.models, 'sizes': args.sizes, 'repeat': args.repeat},
+        'cases': {},
+    }
+
+    def record(name, result):
+        results['cases'][name] = result
+        stages = ' '.join(f"{stage}={ms:.1f}" for stage, ms in result['stages_ms'].items())
+        print(f"{name:<36} {result['median_ms']:>9.1f}ms  {stages}", flush=True)
+
+    # Compositing does not depend on the model, so it runs once per size
+    for size, data in inputs.items():
+        image = server.ImageSource(data).full_image()
+        mask = Image.fromarray(np.asarray(image.convert('L')) // 2 + 64)
+        record(f"apply_background/white/{size:g}mp",
+               run_case(lambda: server.apply_background(image, 'white', mask), args.repeat))
+
+    for model_name in args.models:
+        torch.manual_seed(0)
+        server.net = MODEL_ARCHITECTURES[model_name](3, 1).eval()
+        server.start_services()
+
+        for size, data in inputs.items():
+            record(f"process_image/{model_name}/{size:g}mp",
+                   run_case(lambda: server.process_image(server.net, server.ImageSource(data)), args.repeat))
+            buffer = io.BytesIO()
+            server.process_image(server.net, server.ImageSource(data)).save(buffer, format='PNG', compress_level=1)
+            for name, path, upload in ENDPOINTS:
+                record(f"{name}/{model_name}/{size:g}mp",
+                       run_case(endpoint_call(client, path, upload, data, buffer.getvalue()), args.repeat))
+
+        if server.encoder is not None:
+            server.encoder.shutdown()
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"\nWrote {args.output}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline.get('environment') != results['environment']:
+            print("\nWARNING: the baseline was recorded in a different environment")
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print(f"\n{len(regressions)} case(s) slower than the baseline by more than {args.threshold:.0%}")
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,37 @@
+"""
+Synthetic test photos for the benchmarks: a silhouette from
+generate_model_overlays.py over a smooth random background, JPEG-encoded.
+"""
+
+import io
+import os
+import sys
+
+import numpy as np
+from PIL import Image
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from generate_model_overlays import generate_model_standing, generate_mannequin, generate_flat_lay
+
+SILHOUETTES = (generate_model_standing, generate_mannequin, generate_flat_lay)
+
+
+def make_image(megapixels, seed=0, quality=90):
+    """A 4:3 JPEG of a drawn silhouette over a smooth random background"""
+    width = int(round((megapixels * 1e6 * 4 / 3) ** 0.5))
+    height = int(round(megapixels * 1e6 / width))
+    rng = np.random.default_rng(seed)
+
+    # Low-frequency color field plus a little sensor-like noise
+    field = Image.fromarray(rng.integers(0, 256, (12, 16, 3), dtype=np.uint8), 'RGB')
+    background = np.asarray(field.resize((width, height), Image.BICUBIC), dtype=np.int16)
+    background = background + rng.integers(-8, 9, background.shape, dtype=np.int16)
+    image = Image.fromarray(np.clip(background, 0, 255).astype(np.uint8), 'RGB')
+
+    silhouette = SILHOUETTES[seed % len(SILHOUETTES)](width // 2, height)
+    image.paste(silhouette, (width // 4, 0), silhouette)
+
+    buffer = io.BytesIO()
+    image.save(buffer, format='JPEG', quality=quality)
+    return buffer.getvalue()
@@ -263,4 +263,31 @@ class SalObjDataset(Dataset):
 		if self.transform:
 			sample = self.transform(sample)
 
-		return sample 
\ No newline at end of file
+		return sample 
+
+
+class ImageFolderDataset(Dataset):
+	"""Unlabelled images for batch inference. Returns the preprocessed tensor,
+	the index into img_name_list and whether the image could be decoded."""
+	def __init__(self,img_name_list,transform,output_size=320):
+		self.image_name_list = img_name_list
+		self.transform = transform
+		self.output_size = output_size
+
+	def __len__(self):
+		return len(self.image_name_list)
+
+	def __getitem__(self,idx):
+
+		try:
+			image = Image.open(self.image_name_list[idx])
+			# JPEGs decode at reduced size; the transform only needs output_size pixels
+			image.draft('RGB',(self.output_size,self.output_size))
+			tensor = self.transform(image)
+			ok = True
+		except Exception:
+			# Keep the batch shape; the caller skips images that failed to decode
+			tensor = torch.zeros((3,self.output_size,self.output_size))
+			ok = False
+
+		return {'idx':idx, 'image':tensor, 'ok':ok}
@@ -0,0 +1,127 @@
+"""
+Output encoding for the server's image responses.
+Requests pick the format and its settings (PNG compress level, lossy or
+lossless WebP quality, JPEG quality for opaque results, or raw 8-bit bytes
+for single-channel masks). Encoding runs on a dedicated thread pool: PIL's
+encoders release the GIL, so large cutouts are encoded in parallel while the
+number of concurrent encodes stays bounded.
+"""
+
+import io
+import logging
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger('u2net-server')
+
+# Output formats supported by the server: name -> (PIL format, mimetype, file extension)
+OUTPUT_FORMATS = {
+    'png': ('PNG', 'image/png', '.png'),
+    'webp': ('WEBP', 'image/webp', '.webp'),
+    'jpeg': ('JPEG', 'image/jpeg', '.jpg'),
+    'jpg': ('JPEG', 'image/jpeg', '.jpg'),
+    # Row-major 8-bit pixels of an L image, with no header
+    'raw': (None, 'application/octet-stream', '.raw'),
+}
+
+DEFAULT_PNG_LEVEL = 6
+DEFAULT_QUALITY = 90
+
+
+class EncodeOptions(namedtuple('EncodeOptions', ['format', 'quality', 'lossless', 'compress_level'])):
+    """Validated encoder settings; quality is unused for PNG and compress_level only for PNG"""
+
+    @property
+    def pil_format(self):
+        return OUTPUT_FORMATS[self.format][0]
+
+    @property
+    def mimetype(self):
+        return OUTPUT_FORMATS[self.format][1]
+
+    @property
+    def extension(self):
+        return OUTPUT_FORMATS[self.format][2]
+
+    def save_params(self):
+        """Keyword arguments for Image.save"""
+        if self.pil_format == 'PNG':
+            return {'compress_level': self.compress_level}
+        if self.pil_format == 'WEBP':
+            # For lossless WebP, quality is the compression effort
+            return {'quality': self.quality, 'lossless': self.lossless}
+        return {'quality': self.quality}
+
+
+def _parse_int(name, value, low, high):
+    try:
+        number = int(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"{name} must be an integer, got {value!r}")
+    if not low <= number <= high:
+        raise ValueError(f"{name} must be between {low} and {high}")
+    return number
+
+
+def _parse_bool(value):
+    if isinstance(value, bool):
+        return value
+    return str(value).lower() in ('1', 'true', 'yes', 'on')
+
+
+def encode_options(output_format='png', quality=None, lossless=None, compress_level=None,
+                   default_level=DEFAULT_PNG_LEVEL):
+    """Build EncodeOptions from request values (strings or JSON values); raises ValueError"""
+    output_format = str(output_format or 'png').lower()
+    if output_format not in OUTPUT_FORMATS:
+        raise ValueError(f"Unsupported output format: {output_format}")
+    if output_format == 'jpg':
+        output_format = 'jpeg'
+    pil_format = OUTPUT_FORMATS[output_format][0]
+
+    if pil_format is None:
+        return EncodeOptions(output_format, None, False, None)
+    if pil_format == 'PNG':
+        level = default_level if compress_level is None else _parse_int('level', compress_level, 0, 9)
+        return EncodeOptions(output_format, None, False, level)
+
+    quality = DEFAULT_QUALITY if quality is None else _parse_int('quality', quality, 0, 100)
+    lossless = pil_format == 'WEBP' and lossless is not None and _parse_bool(lossless)
+    return EncodeOptions(output_format, quality, lossless, None)
+
+
+def encode_image(image, options):
+    """Encode an image with the given EncodeOptions, returning (bytes, mimetype)"""
+    if options.format == 'raw':
+        if image.mode != 'L':
+            raise ValueError("Raw output is only available for masks")
+        return image.tobytes(), options.mimetype
+
+    if options.pil_format == 'JPEG' and image.mode not in ('RGB', 'L'):
+        # JPEG has no alpha channel, so only opaque results can be encoded
+        if image.mode == 'RGBA' and image.getchannel('A').getextrema()[0] < 255:
+            raise ValueError("JPEG output requires an opaque background")
+        image = image.convert('RGB')
+
+    buffer = io.BytesIO()
+    image.save(buffer, format=options.pil_format, **options.save_params())
+    return buffer.getvalue(), options.mimetype
+
+
+class ImageEncoder:
+    """Thread pool that encodes images off the request threads"""
+
+    def __init__(self, max_workers=4):
+        self.max_workers = max_workers
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='encoder')
+
+    def submit(self, image, options):
+        """Start encoding an image; the future resolves to (bytes, mimetype)"""
+        return self._pool.submit(encode_image, image, options)
+
+    def encode(self, image, options):
+        """Encode an image on the pool and wait for the result"""
+        return self.submit(image, options).result()
+
+    def shutdown(self):
+        self._pool.shutdown(wait=True)
@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+"""
+Export a U-2-Net model to ONNX for the onnxruntime backend.
+Writes saved_models/<model>/<model>.onnx (dynamic batch dimension) and checks
+the ONNX Runtime output against PyTorch, on random inputs or on a folder of
+real images, so the backend can be adopted with confidence.
+
+Usage:
+    python export_onnx.py [--model u2net] [--check-dir IMAGES] [--tolerance 1e-3]
+"""
+
+import os
+import sys
+import time
+import logging
+import argparse
+
+import torch
+
+from archive_io import IMAGE_EXTENSIONS
+from inference import (CustomRescale, MODEL_ARCHITECTURES, OnnxModel, load_model, export_onnx,
+                       onnx_model_path, compare_outputs, run_model)
+
+# Set up logging to console
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    handlers=[
+        logging.StreamHandler(sys.stdout)
+    ]
+)
+logger = logging.getLogger('export-onnx')
+
+
+def check_inputs(check_dir, count):
+    """A (N, 3, 320, 320) batch from check_dir, or random inputs when no folder is given"""
+    if not check_dir:
+        return torch.rand(count, 3, 320, 320)
+
+    from PIL import Image
+    transform = CustomRescale(320)
+    names = sorted(n for n in os.listdir(check_dir) if os.path.splitext(n)[1].lower() in IMAGE_EXTENSIONS)
+    tensors = []
+    for name in names[:count]:
+        image = Image.open(os.path.join(check_dir, name)).convert('RGB')
+        tensors.append(transform(image))
+    if not tensors:
+        raise ValueError(f"No images found in {check_dir}")
+    return torch.stack(tensors)
+
+
+def time_model(net, inputs, repeat):
+    run_model(net, inputs)
+    start = time.perf_counter()
+    for _ in range(repeat):
+        run_model(net, inputs)
+    return (time.perf_counter() - start) / repeat
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Export a U-2-Net model to ONNX and check parity')
+    parser.add_argument('--model', type=str, default='u2net', choices=sorted(MODEL_ARCHITECTURES),
+                        help='Model to export')
+    parser.add_argument('--output', type=str, default=None,
+                        help='Output path (default: saved_models/<model>/<model>.onnx)')
+    parser.add_argument('--opset', type=int, default=17, help='ONNX opset version')
+    parser.add_argument('--check-dir', type=str, default=None,
+                        help='Folder of images for the parity check (default: random inputs)')
+    parser.add_argument('--check-count', type=int, default=4, help='Images in the parity check batch')
+    parser.add_argument('--tolerance', type=float, default=1e-3,
+                        help='Maximum allowed absolute difference of the fused prediction')
+    parser.add_argument('--threads', type=int, default=0, help='ONNX Runtime intra-op threads (0 = default)')
+    parser.add_argument('--repeat', type=int, default=3, help='Timed runs per backend')
+    args = parser.parse_args()
+
+    net = load_model(args.model)
+    if net is None:
+        logger.error("Failed to load model. Exiting.")
+        return 1
+
+    path = export_onnx(net, args.output or onnx_model_path(args.model), opset=args.opset)
+    logger.info(f"ONNX model size: {os.path.getsize(path) / (1024 * 1024):.1f} MB")
+
+    onnx_net = OnnxModel(path, intra_op_threads=args.threads)
+    inputs = check_inputs(args.check_dir, args.check_count)
+    parity = compare_outputs(net, onnx_net, inputs)
+    logger.info(f"Parity on {len(inputs)} inputs: max abs diff {parity['max_abs_diff']:.2e}, "
+                f"mask MAE {parity['mask_mae']:.2e}")
+
+    torch_time = time_model(net, inputs, args.repeat)
+    onnx_time = time_model(onnx_net, inputs, args.repeat)
+    logger.info(f"Batch of {len(inputs)}: torch {torch_time * 1000:.0f} ms, "
+                f"onnxruntime {onnx_time * 1000:.0f} ms ({torch_time / onnx_time:.2f}x)")
+
+    if parity['max_abs_diff'] > args.tolerance:
+        logger.error(f"Parity check failed (tolerance {args.tolerance})")
+        return 1
+    logger.info("Parity check passed")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
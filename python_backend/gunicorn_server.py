@@ -0,0 +1,66 @@
+"""
+Production serving for the U-2-Net server through gunicorn.
+The app (model included) is loaded in the gunicorn master before the workers
+are forked, so as with prefork.py every worker shares the weight pages
+copy-on-write. Workers use gunicorn's threaded worker class; gunicorn
+provides the worker supervision, request timeouts, keep-alive handling and
+graceful shutdown (SIGTERM lets in-flight requests finish).
+"""
+
+import gc
+import logging
+
+from gunicorn.app.base import BaseApplication
+
+logger = logging.getLogger('u2net-server')
+
+
+def bind_address(host, port):
+    return f"[{host}]:{port}" if ':' in host else f"{host}:{port}"
+
+
+class GunicornServer(BaseApplication):
+    """Run an already loaded app under gunicorn with the given settings"""
+
+    def __init__(self, app, options, init_worker=None, stop_worker=None):
+        self.application = app
+        self.options = options
+        # Called in each worker once it is ready, with a stable worker index
+        self.init_worker = init_worker
+        # Called in each worker as it exits
+        self.stop_worker = stop_worker
+        super().__init__()
+
+    def load_config(self):
+        for key, value in self.options.items():
+            self.cfg.set(key, value)
+        self.cfg.set('when_ready', self._when_ready)
+        self.cfg.set('pre_fork', self._pre_fork)
+        self.cfg.set('post_worker_init', self._post_worker_init)
+        self.cfg.set('worker_exit', self._worker_exit)
+
+    def load(self):
+        return self.application
+
+    def _when_ready(self, arbiter):
+        # Move everything allocated so far (model included) out of the GC's
+        # reach so collections in the workers don't dirty the shared pages
+        gc.collect()
+        gc.freeze()
+        logger.info(f"Starting {self.cfg.workers} gunicorn workers with {self.cfg.threads} threads "
+                    f"on http://{', '.join(self.cfg.bind)}")
+
+    def _pre_fork(self, arbiter, worker):
+        # gunicorn numbers workers by age; give replacements the index of the
+        # worker they replace so shared metrics files stay one per slot
+        used = {w.index for w in arbiter.WORKERS.values() if hasattr(w, 'index')}
+        worker.index = min(set(range(len(used) + 1)) - used)
+
+    def _post_worker_init(self, worker):
+        if self.init_worker is not None:
+            self.init_worker(worker.index)
+        logger.info(f"Worker {worker.index} (pid {worker.pid}) ready")
+
+    def _worker_exit(self, arbiter, worker):
+        if self.stop_worker is not None:
+            self.stop_worker()
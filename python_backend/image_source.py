@@ -0,0 +1,74 @@
+"""
+Two-branch decoding of uploaded images.
+Inference only needs a 320x320 input, so JPEGs are decoded for it at reduced
+resolution with PIL's draft mode (libjpeg DCT scaling), which is much faster
+and smaller than a full decode of a camera photo. The full-resolution image is
+only decoded when compositing asks for it.
+
+Uploads above a pixel budget can be shrunk on the way in: the full-resolution
+branch then decodes (at reduced scale for JPEGs) straight to the budget.
+"""
+
+import io
+import math
+
+from PIL import Image
+
+
+def fit_pixels(size, max_pixels=None):
+    """Scale (width, height) down, keeping the aspect ratio, to at most max_pixels pixels"""
+    width, height = size
+    if not max_pixels or width * height <= max_pixels:
+        return size
+    scale = math.sqrt(max_pixels / (width * height))
+    return max(1, int(width * scale)), max(1, int(height * scale))
+
+
+class ImageSource:
+    """An uploaded image with a cheap inference branch and a lazy full-resolution branch"""
+
+    def __init__(self, data=None, image=None, max_pixels=None):
+        if data is None and image is None:
+            raise ValueError("ImageSource needs image bytes or an image")
+        self.data = data
+        # Only the header is read here; raises UnidentifiedImageError for bad uploads
+        self._header = image if image is not None else Image.open(io.BytesIO(data))
+        self.source_size = self._header.size
+        # Size of the full-resolution branch (smaller than the upload when over max_pixels)
+        self.size = fit_pixels(self.source_size, max_pixels)
+        self.format = self._header.format
+        self._full = None
+        self._small = None
+
+    @classmethod
+    def wrap(cls, image):
+        """Return image unchanged if it already is an ImageSource, otherwise wrap the PIL image"""
+        return image if isinstance(image, cls) else cls(image=image)
+
+    def inference_image(self, size=320):
+        """An image at least size x size, decoded at reduced resolution when the format allows it"""
+        if self._small is not None:
+            return self._small
+        if self._full is None and self.data is not None and self.format == 'JPEG':
+            image = Image.open(io.BytesIO(self.data))
+            image.draft('RGB', (size, size))
+            if image.size != self.source_size:
+                image.load()
+                self._small = image
+                return image
+        return self.full_image()
+
+    def full_image(self):
+        """The full-resolution RGB image (shrunk to the pixel budget), decoded on first use"""
+        if self._full is None:
+            image = self._header
+            if self.size != self.source_size:
+                # JPEGs decode at the smallest DCT scale that still covers the budget
+                image.draft('RGB', self.size)
+                if image.mode in ('1', 'P'):
+                    image = image.convert('RGB')
+                image = image.resize(self.size, Image.BILINEAR, reducing_gap=2.0)
+            self._full = image.convert('RGB') if image.mode != 'RGB' else image
+            self._full.load()
+            self._header = None
+        return self._full
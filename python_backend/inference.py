@@ -0,0 +1,339 @@
+"""
+Model-side helpers shared by the server and the offline tools.
+Covers input preprocessing, model loading, the forward pass and turning the
+raw prediction into an 8-bit mask.
+"""
+
+import os
+import copy
+import time
+import logging
+import threading
+
+import numpy as np
+import torch
+from torch.autograd import Variable
+from PIL import Image
+
+from model import U2NET, U2NETP
+
+logger = logging.getLogger('u2net-server')
+
+# Model weights live in saved_models/<name>/<name>.pth next to this file
+models_root = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'saved_models')
+
+# Network class for each model name
+MODEL_ARCHITECTURES = {
+    'u2net': U2NET,
+    'u2net_portrait': U2NET,
+    'u2netp': U2NETP,
+}
+
+# int8 variants are ONNX graphs stored next to the fp32 weights and selected with
+# model names like 'u2net_int8_static'
+QUANTIZATION_MODES = ('dynamic', 'static')
+
+# Inference backends: plain PyTorch, a frozen TorchScript trace, torch.compile (Inductor)
+# or an exported ONNX graph served by ONNX Runtime
+BACKENDS = ('eager', 'torchscript', 'inductor', 'onnxruntime')
+
+# Custom transform function that doesn't rely on the U-2-Net data_loader
+class CustomRescale:
+    """Resize a PIL image once and normalize it into a (3, H, W) float32 tensor.
+    
+    Normalization runs in float32 with broadcasting and writes straight into
+    `out` when given (e.g. a slot of a pooled batch buffer), so the only
+    full-size copies are the PIL resize and the final write.
+    """
+    def __init__(self, output_size, normalize=True, mean=(0.485, 0.456, 0.406), std=(0.229, 0.224, 0.225)):
+        self.output_size = output_size
+        # Fused models (model/fusion.py) normalize inside the first conv and take 0-255 input
+        self.normalize = normalize
+        # (x / 255 - mean) / std == x * scale - offset
+        std = np.asarray(std, dtype=np.float32).reshape(3, 1, 1)
+        self.scale = 1.0 / (255.0 * std)
+        self.offset = np.asarray(mean, dtype=np.float32).reshape(3, 1, 1) / std
+        
+    def __call__(self, image, out=None):
+        size = (self.output_size, self.output_size)
+        # Palette and bilevel images would be resized with nearest neighbour
+        if image.mode in ('1', 'P'):
+            image = image.convert('RGB')
+        image = image.resize(size, Image.BILINEAR)
+        # Other modes (RGBA, CMYK, ...) are converted after the resize, at 320x320
+        if image.mode not in ('RGB', 'L'):
+            image = image.convert('RGB')
+        
+        img = np.asarray(image)
+        # Channel-first view; grayscale broadcasts to all three channels
+        src = img[np.newaxis] if img.ndim == 2 else img.transpose((2, 0, 1))
+        
+        if out is None:
+            out = torch.empty((3,) + size, dtype=torch.float32)
+        dst = out.numpy()
+        if self.normalize:
+            np.multiply(src, self.scale, out=dst, casting='unsafe')
+            np.subtract(dst, self.offset, out=dst)
+        else:
+            np.copyto(dst, src, casting='unsafe')
+        
+        return out
+
+class InputBufferPool:
+    """Reusable (N, 3, H, W) float32 input batches, so requests don't allocate a new one each time"""
+    def __init__(self, size=320, max_free=8):
+        self.size = size
+        self.max_free = max_free
+        self._free = {}  # batch size -> list of buffers
+        self._lock = threading.Lock()
+    
+    def acquire(self, batch_size=1):
+        with self._lock:
+            free = self._free.get(batch_size)
+            if free:
+                return free.pop()
+        return torch.empty((batch_size, 3, self.size, self.size), dtype=torch.float32)
+    
+    def release(self, buffer):
+        with self._lock:
+            free = self._free.setdefault(buffer.shape[0], [])
+            if len(free) < self.max_free:
+                free.append(buffer)
+
+def model_weights_path(model_name):
+    return os.path.join(models_root, model_name, model_name + '.pth')
+
+def quantized_model_path(model_name, mode):
+    return os.path.join(models_root, model_name, f"{model_name}_int8_{mode}.onnx")
+
+def split_model_name(model_name):
+    """Split 'u2net_int8_static' into ('u2net', 'static'); plain names give (name, None)"""
+    for mode in QUANTIZATION_MODES:
+        suffix = f"_int8_{mode}"
+        if model_name.endswith(suffix):
+            return model_name[:-len(suffix)], mode
+    return model_name, None
+
+def load_model(model_name='u2net'):
+    base_name, quantization = split_model_name(model_name)
+    if quantization is not None:
+        # Quantized variants always run on ONNX Runtime
+        path = quantized_model_path(base_name, quantization)
+        logger.info(f"Loading {model_name} from {path}")
+        if not os.path.exists(path):
+            logger.error(f"ERROR: Quantized model not found at {path} (create it with quantize_model.py)")
+            return None
+        return OnnxModel(path)
+    
+    model_dir = model_weights_path(model_name)
+    
+    logger.info(f"Loading {model_name} from {model_dir}")
+    
+    # Check if model exists
+    if not os.path.exists(model_dir):
+        logger.error(f"ERROR: Model file not found at {model_dir}")
+        return None
+    
+    # Create model
+    net = MODEL_ARCHITECTURES.get(model_name, U2NET)(3, 1)
+    
+    try:
+        if torch.cuda.is_available():
+            net.load_state_dict(torch.load(model_dir))
+            net.cuda()
+            net.eval()
+            logger.info("Model loaded on CUDA")
+        else:
+            net.load_state_dict(torch.load(model_dir, map_location='cpu'))
+            net.eval()
+            logger.info("Model loaded on CPU")
+        
+        return net
+    except Exception as e:
+        logger.error(f"Error loading model: {e}")
+        return None
+
+def onnx_model_path(model_name):
+    return os.path.join(models_root, model_name, model_name + '.onnx')
+
+class FusedPrediction(torch.nn.Module):
+    """Expose U2NET.predict as forward so the backends trace, compile or export only the fused output"""
+    def __init__(self, net):
+        super().__init__()
+        self.net = net
+    
+    def forward(self, x):
+        return self.net.predict(x)
+
+def export_onnx(net, path, opset=17):
+    """Export the fused prediction of a U2NET/U2NETP to ONNX with a dynamic batch dimension"""
+    net = FusedPrediction(copy.deepcopy(net).cpu().eval())
+    output_names = ['d0']
+    dynamic_axes = {name: {0: 'batch'} for name in ['input'] + output_names}
+    
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with torch.no_grad():
+        torch.onnx.export(net, torch.zeros(1, 3, 320, 320), tmp_path,
+                          input_names=['input'], output_names=output_names,
+                          dynamic_axes=dynamic_axes, opset_version=opset, dynamo=False)
+    os.replace(tmp_path, path)
+    logger.info(f"Exported ONNX model to {path}")
+    return path
+
+class OnnxModel:
+    """Callable stand-in for the torch model that runs an ONNX Runtime session.
+    
+    Returns the fused prediction, like U2NET.predict. The session is created
+    in the process that first uses it, since ONNX Runtime's thread pools don't
+    survive fork().
+    """
+    def __init__(self, path, intra_op_threads=0, inter_op_threads=0):
+        self.path = path
+        self.intra_op_threads = intra_op_threads
+        self.inter_op_threads = inter_op_threads
+        self._session = None
+        self._pid = None
+        self._lock = threading.Lock()
+    
+    def session(self):
+        with self._lock:
+            if self._session is None or self._pid != os.getpid():
+                import onnxruntime as ort
+                options = ort.SessionOptions()
+                options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+                options.intra_op_num_threads = self.intra_op_threads
+                options.inter_op_num_threads = self.inter_op_threads
+                if self.inter_op_threads > 1:
+                    options.execution_mode = ort.ExecutionMode.ORT_PARALLEL
+                self._session = ort.InferenceSession(self.path, options, providers=['CPUExecutionProvider'])
+                self._pid = os.getpid()
+                logger.info(f"ONNX Runtime session created for {self.path}")
+            return self._session
+    
+    def __call__(self, inputs):
+        session = self.session()
+        # The fused prediction is the first output; ONNX Runtime skips nodes only other outputs need
+        fused = session.get_outputs()[0].name
+        outputs = session.run([fused], {'input': inputs.detach().cpu().numpy()})
+        return torch.from_numpy(outputs[0])
+
+def compare_outputs(reference, candidate, inputs):
+    """Compare the fused predictions of two models on the same (N, 3, 320, 320) batch.
+    
+    Returns the largest raw output difference and the mean absolute difference
+    of the normalized masks (0-1 scale).
+    """
+    ref = run_model(reference, inputs).float().cpu()
+    out = run_model(candidate, inputs).float().cpu()
+    mask_diffs = [(norm_pred(r[0]) - norm_pred(o[0])).abs().mean().item() for r, o in zip(ref, out)]
+    return {
+        'max_abs_diff': (ref - out).abs().max().item(),
+        'mask_mae': sum(mask_diffs) / len(mask_diffs),
+    }
+
+def compile_model(net, model_name, backend='eager', intra_op_threads=0, inter_op_threads=0):
+    """Wrap a loaded model in the requested inference backend.
+    
+    TorchScript traces are frozen and cached next to the weights, keyed on the
+    torch version, device and weights file, so restarts load them instead of
+    re-tracing. Inductor keeps its compiled kernels in an on-disk cache in the
+    same directory. For ONNX Runtime the model is exported to
+    saved_models/<model>/<model>.onnx when that file is missing or older than
+    the weights; the thread counts only apply to this backend.
+    """
+    if isinstance(net, OnnxModel):
+        # Quantized models are already ONNX graphs
+        if backend not in ('eager', 'onnxruntime'):
+            logger.info(f"Ignoring backend {backend} for a quantized model, using ONNX Runtime")
+        net.intra_op_threads = intra_op_threads
+        net.inter_op_threads = inter_op_threads
+        return net
+    if backend == 'eager' or net is None:
+        return net
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown backend: {backend}")
+    
+    cache_dir = os.path.join(models_root, model_name)
+    device = next(net.parameters()).device
+    # Fused models take different input, so their artifacts are cached separately
+    cache_name = model_name + '_fused' if getattr(net, 'raw_input', False) else model_name
+    
+    if backend == 'torchscript':
+        weights = model_weights_path(model_name)
+        stamp = f"{os.path.getsize(weights)}-{int(os.path.getmtime(weights))}" if os.path.exists(weights) else 'none'
+        cache_path = os.path.join(cache_dir, f"{cache_name}.predict.torchscript-{torch.__version__}-{device.type}-{stamp}.pt")
+        
+        if os.path.exists(cache_path):
+            logger.info(f"Loading cached TorchScript model from {cache_path}")
+            return torch.jit.load(cache_path, map_location=device)
+        
+        logger.info("Tracing TorchScript model...")
+        start = time.perf_counter()
+        with torch.no_grad():
+            traced = torch.jit.trace(FusedPrediction(net).eval(), torch.zeros(1, 3, 320, 320, device=device))
+            traced = torch.jit.freeze(traced)
+        
+        try:
+            os.makedirs(cache_dir, exist_ok=True)
+            tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+            torch.jit.save(traced, tmp_path)
+            os.replace(tmp_path, cache_path)
+            logger.info(f"Traced in {time.perf_counter() - start:.1f}s, cached at {cache_path}")
+        except OSError as e:
+            logger.error(f"Could not cache TorchScript model: {e}")
+        return traced
+    
+    if backend == 'onnxruntime':
+        path = os.path.join(cache_dir, cache_name + '.onnx')
+        weights = model_weights_path(model_name)
+        if not os.path.exists(path) or (os.path.exists(weights) and os.path.getmtime(weights) > os.path.getmtime(path)):
+            export_onnx(net, path)
+        return OnnxModel(path, intra_op_threads, inter_op_threads)
+    
+    # Inductor: persist compiled kernels across restarts
+    os.environ.setdefault('TORCHINDUCTOR_CACHE_DIR', os.path.join(cache_dir, 'inductor_cache'))
+    import torch._inductor.config as inductor_config
+    inductor_config.fx_graph_cache = True
+    logger.info("Compiling model with torch.compile (inductor)")
+    return torch.compile(FusedPrediction(net).eval(), backend='inductor')
+
+def warmup_model(net, runs=2, batch_sizes=(1,)):
+    """Run a few forward passes so compilation and allocator warmup happen before real traffic"""
+    if net is None or runs <= 0:
+        return
+    start = time.perf_counter()
+    for batch_size in batch_sizes:
+        inputs = torch.zeros(batch_size, 3, 320, 320)
+        for _ in range(runs):
+            run_model(net, inputs)
+    logger.info(f"Warmup finished in {time.perf_counter() - start:.1f}s "
+                f"({runs} runs at batch sizes {list(batch_sizes)})")
+
+def norm_pred(d):
+    ma = torch.max(d)
+    mi = torch.min(d)
+    dn = (d-mi)/(ma-mi)
+    return dn
+
+def run_model(net, inputs):
+    """Run a forward pass on a (N, 3, 320, 320) batch and return the fused prediction"""
+    if torch.cuda.is_available():
+        inputs = inputs.cuda()
+    
+    with torch.no_grad():
+        if isinstance(net, (U2NET, U2NETP)):
+            # Only the fused output is used, so skip the other side outputs
+            return net.predict(Variable(inputs))
+        # Compiled backends already return just the fused prediction
+        return net(Variable(inputs))
+
+def prediction_to_numpy(pred):
+    """Normalize one (1, H, W) prediction (per image, even when batched) and convert to numpy"""
+    pred = norm_pred(pred[0])
+    return pred.cpu().data.numpy()
+
+def upsample_mask(predict_np, size):
+    """Turn a normalized prediction into an 8-bit L mask at the given (width, height)"""
+    mask = Image.fromarray((predict_np * 255).astype(np.uint8))
+    return mask.resize(size, Image.BILINEAR)
@@ -0,0 +1,176 @@
+"""
+Budgeted image intake for uploads.
+Checks the upload size and the header dimensions before anything is decoded,
+shrinks oversized images during decode when allowed (or rejects them), and
+keeps a running estimate of the memory held by requests in flight so new work
+waits for room instead of pushing the process into the OOM killer.
+"""
+
+import time
+import logging
+import warnings
+import threading
+from contextlib import contextmanager
+
+from PIL import Image
+
+from image_source import ImageSource, fit_pixels
+
+logger = logging.getLogger('u2net-server')
+
+# Working memory per pixel of the full-resolution branch: RGB original, mask,
+# RGBA result and encoder/guided-filter scratch
+BYTES_PER_PIXEL = 16
+
+# Non-JPEG images can't be decoded at reduced scale, so they are only shrunk
+# when the full decode stays within this multiple of the pixel budget
+FULL_DECODE_FACTOR = 4
+
+
+class IntakeError(Exception):
+    """An upload the server won't take; status is the HTTP status to answer with"""
+    status = 400
+
+
+class UploadTooLargeError(IntakeError):
+    status = 413
+
+
+class IntakeBusyError(IntakeError):
+    """Raised when in-flight requests hold the memory budget for longer than the wait timeout"""
+    status = 503
+
+
+class ImageIntake:
+    """Enforces byte/pixel budgets on uploads and tracks estimated in-flight memory"""
+
+    def __init__(self, max_bytes=50 * 1024 * 1024, max_pixels=50_000_000, allow_downscale=True,
+                 memory_budget=2 * 1024 * 1024 * 1024, wait_timeout=10.0):
+        self.max_bytes = max_bytes
+        self.max_pixels = max_pixels
+        self.allow_downscale = allow_downscale
+        self.memory_budget = memory_budget
+        self.wait_timeout = wait_timeout
+        self._condition = threading.Condition()
+        self._in_flight = 0
+        self._active = 0
+        self.accepted = 0
+        self.downscaled = 0
+        self.rejected = 0
+        self.deferred = 0
+        self.timed_out = 0
+
+        # PIL refuses to open anything over twice MAX_IMAGE_PIXELS as a decompression
+        # bomb. Only ever raise that limit, to above anything shrunk here, so oversized
+        # uploads reach the checks in open() and get its errors
+        if max_pixels and Image.MAX_IMAGE_PIXELS is not None:
+            Image.MAX_IMAGE_PIXELS = max(Image.MAX_IMAGE_PIXELS, max_pixels * FULL_DECODE_FACTOR)
+            # Images between the budget and that limit are shrunk or refused here instead
+            warnings.simplefilter('ignore', Image.DecompressionBombWarning)
+
+    def _reject(self, message):
+        with self._condition:
+            self.rejected += 1
+        raise UploadTooLargeError(message)
+
+    def check_bytes(self, size):
+        if self.max_bytes and size > self.max_bytes:
+            self._reject(f"Upload is {size} bytes, the limit is {self.max_bytes}")
+
+    def read(self, stream):
+        """Read an upload stream, refusing to buffer more than the byte budget"""
+        data = stream.read(self.max_bytes + 1) if self.max_bytes else stream.read()
+        self.check_bytes(len(data))
+        return data
+
+    def open(self, data):
+        """Validate an upload from its header and return an ImageSource within the pixel budget.
+
+        Raises UnidentifiedImageError for data that isn't an image and
+        UploadTooLargeError when the image is over budget and can't be shrunk.
+        """
+        self.check_bytes(len(data))
+        try:
+            source = ImageSource(data)
+        except Image.DecompressionBombError:
+            self._reject(f"Image is too large to decode, the limit is {self.max_pixels} pixels")
+
+        width, height = source.source_size
+        if not self.max_pixels or width * height <= self.max_pixels:
+            with self._condition:
+                self.accepted += 1
+            return source
+
+        if not self.allow_downscale:
+            self._reject(f"Image is {width}x{height}, the limit is {self.max_pixels} pixels")
+        if source.format != 'JPEG' and width * height > self.max_pixels * FULL_DECODE_FACTOR:
+            self._reject(f"Image is {width}x{height}, too large to decode and shrink")
+
+        target = fit_pixels(source.source_size, self.max_pixels)
+        logger.info(f"Shrinking {width}x{height} upload to {target[0]}x{target[1]}")
+        with self._condition:
+            self.accepted += 1
+            self.downscaled += 1
+        return ImageSource(data, max_pixels=self.max_pixels)
+
+    @staticmethod
+    def estimate(sources):
+        """Estimated peak working memory for processing one or more ImageSources (or PIL images)"""
+        if not isinstance(sources, (list, tuple)):
+            sources = [sources]
+        total = 0
+        for source in sources:
+            width, height = source.size
+            total += width * height * BYTES_PER_PIXEL + len(getattr(source, 'data', None) or b'')
+        return total
+
+    @contextmanager
+    def reserve(self, nbytes):
+        """Hold nbytes of the memory budget for the duration of the block.
+
+        Waits up to wait_timeout for in-flight work to release enough budget and
+        raises IntakeBusyError after that. A request larger than the whole
+        budget is let through only when nothing else is running.
+        """
+        if not self.memory_budget:
+            yield
+            return
+
+        deadline = time.monotonic() + self.wait_timeout
+        with self._condition:
+            waited = False
+            while self._active and self._in_flight + nbytes > self.memory_budget:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self.timed_out += 1
+                    raise IntakeBusyError("Server is busy, try again later")
+                if not waited:
+                    waited = True
+                    self.deferred += 1
+                self._condition.wait(remaining)
+            self._in_flight += nbytes
+            self._active += 1
+
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._in_flight -= nbytes
+                self._active -= 1
+                self._condition.notify_all()
+
+    def stats(self):
+        with self._condition:
+            return {
+                'max_bytes': self.max_bytes,
+                'max_pixels': self.max_pixels,
+                'allow_downscale': self.allow_downscale,
+                'memory_budget': self.memory_budget,
+                'in_flight_bytes': self._in_flight,
+                'in_flight_requests': self._active,
+                'accepted': self.accepted,
+                'downscaled': self.downscaled,
+                'rejected': self.rejected,
+                'deferred': self.deferred,
+                'timed_out': self.timed_out,
+            }
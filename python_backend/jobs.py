@@ -0,0 +1,260 @@
+"""
+Asynchronous job queue for background removal.
+Clients submit work and poll for it instead of holding a connection open for
+the whole request. The queue is bounded so that a saturated server rejects new
+work immediately instead of piling up threads, and finished results expire
+after a TTL.
+
+Job functions return (data bytes, info dict). With several worker processes
+the queue publishes job status and results to a shared directory so any
+worker can answer a poll or fetch.
+"""
+
+import os
+import json
+import time
+import uuid
+import queue
+import logging
+import threading
+from collections import OrderedDict
+
+logger = logging.getLogger('u2net-server')
+
+# Job states
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+
+
+class QueueFullError(Exception):
+    """Raised when the job queue has no room for new work"""
+
+
+class Job:
+    def __init__(self, func, args, kwargs):
+        self.id = uuid.uuid4().hex
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+        self.status = QUEUED
+        self.result = None  # (data bytes, info dict) once done
+        self.error = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.sequence = 0  # Submission order, used for queue positions
+
+    def to_dict(self):
+        info = {
+            'jobId': self.id,
+            'status': self.status,
+            'createdAt': self.created_at,
+            'startedAt': self.started_at,
+            'finishedAt': self.finished_at,
+        }
+        if self.error is not None:
+            info['error'] = self.error
+        return info
+
+
+class JobQueue:
+    """Bounded in-process work queue served by a fixed pool of threads"""
+
+    def __init__(self, max_queued=32, num_workers=2, result_ttl=300, shared_dir=None):
+        self.max_queued = max_queued
+        self.num_workers = num_workers
+        self.result_ttl = result_ttl
+        self.shared_dir = shared_dir
+        self._last_cleanup = 0.0
+        self._queue = queue.Queue(maxsize=max_queued)
+        self._jobs = OrderedDict()  # job id -> Job, in submission order
+        self._lock = threading.Lock()
+        self._threads = []
+        self._next_sequence = 0
+        self._started_sequence = 0  # Sequence of the last job a worker picked up
+        self.submitted = 0
+        self.rejected = 0
+        self.completed = 0
+        self.failed = 0
+        self.expired = 0
+
+        if self.shared_dir:
+            os.makedirs(self.shared_dir, exist_ok=True)
+
+    def start(self):
+        for i in range(self.num_workers):
+            thread = threading.Thread(target=self._run, name=f'job-worker-{i}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        logger.info(f"Job queue started ({self.num_workers} workers, "
+                    f"{self.max_queued} slots, results kept {self.result_ttl}s)")
+
+    def submit(self, func, *args, **kwargs):
+        """Queue func(*args, **kwargs) and return the Job, or raise QueueFullError"""
+        job = Job(func, args, kwargs)
+        with self._lock:
+            self._expire()
+            job.sequence = self._next_sequence + 1
+            try:
+                self._queue.put_nowait(job)
+            except queue.Full:
+                self.rejected += 1
+                raise QueueFullError("Job queue is full")
+            self._next_sequence = job.sequence
+            self._jobs[job.id] = job
+            self.submitted += 1
+            position = max(0, job.sequence - self._started_sequence - 1)
+        self._publish(job, position)
+        return job
+
+    def status(self, job_id):
+        """Status dict for a job (with queuePosition while queued), or None if unknown"""
+        with self._lock:
+            self._expire()
+            job = self._jobs.get(job_id)
+            if job is not None:
+                info = job.to_dict()
+                info['queuePosition'] = (max(0, job.sequence - self._started_sequence - 1)
+                                         if job.status == QUEUED else None)
+                if job.status == DONE:
+                    info['info'] = job.result[1]
+                return info
+        return self._read_shared_status(job_id)
+
+    def result(self, job_id):
+        """Return (status dict, data bytes, info dict); data is None until the job is done"""
+        status = self.status(job_id)
+        if status is None or status['status'] != DONE:
+            return status, None, None
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is not None and job.result is not None:
+                return status, job.result[0], job.result[1]
+        data = self._read_shared_result(job_id)
+        if data is None:
+            return None, None, None
+        return status, data, status.get('info', {})
+
+    def depth(self):
+        return self._queue.qsize()
+
+    def _run(self):
+        while True:
+            job = self._queue.get()
+            with self._lock:
+                job.status = RUNNING
+                job.started_at = time.time()
+                self._started_sequence = max(self._started_sequence, job.sequence)
+
+            self._publish(job)
+
+            try:
+                result = job.func(*job.args, **job.kwargs)
+            except Exception as e:
+                logger.error(f"Job {job.id} failed: {e}")
+                with self._lock:
+                    job.status = FAILED
+                    job.error = str(e)
+                    job.finished_at = time.time()
+                    self.failed += 1
+            else:
+                with self._lock:
+                    job.status = DONE
+                    job.result = result
+                    job.finished_at = time.time()
+                    self.completed += 1
+            finally:
+                # Drop the inputs as soon as they are no longer needed
+                job.args = job.kwargs = None
+                self._publish(job)
+                self._queue.task_done()
+
+    @staticmethod
+    def _valid_id(job_id):
+        return len(job_id) == 32 and all(c in '0123456789abcdef' for c in job_id)
+
+    def _publish(self, job, position=None):
+        """Write the job status (and result once done) to the shared directory"""
+        if not self.shared_dir:
+            return
+        info = job.to_dict()
+        info['queuePosition'] = position
+        if job.status == DONE:
+            info['info'] = job.result[1]
+        base = os.path.join(self.shared_dir, job.id)
+        try:
+            if job.status == DONE:
+                self._write_atomic(base + '.bin', job.result[0])
+            self._write_atomic(base + '.json', json.dumps(info).encode('utf-8'))
+        except OSError as e:
+            logger.error(f"Error publishing job {job.id}: {e}")
+        if job.status in (DONE, FAILED):
+            self._cleanup_shared()
+
+    @staticmethod
+    def _write_atomic(path, data):
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+    def _read_shared_status(self, job_id):
+        if not self.shared_dir or not self._valid_id(job_id):
+            return None
+        try:
+            with open(os.path.join(self.shared_dir, job_id + '.json'), 'rb') as f:
+                info = json.loads(f.read())
+        except (OSError, ValueError):
+            return None
+        finished_at = info.get('finishedAt')
+        if finished_at is not None and finished_at < time.time() - self.result_ttl:
+            return None
+        return info
+
+    def _read_shared_result(self, job_id):
+        try:
+            with open(os.path.join(self.shared_dir, job_id + '.bin'), 'rb') as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def _cleanup_shared(self):
+        """Delete shared job files older than the result TTL"""
+        now = time.time()
+        if now - self._last_cleanup < max(1.0, self.result_ttl / 10):
+            return
+        self._last_cleanup = now
+        for name in os.listdir(self.shared_dir):
+            path = os.path.join(self.shared_dir, name)
+            try:
+                if os.path.getmtime(path) + self.result_ttl < now:
+                    os.remove(path)
+            except OSError:
+                pass
+
+    def _expire(self):
+        # Caller holds the lock
+        cutoff = time.time() - self.result_ttl
+        expired = [job_id for job_id, job in self._jobs.items()
+                   if job.finished_at is not None and job.finished_at < cutoff]
+        for job_id in expired:
+            del self._jobs[job_id]
+            self.expired += 1
+
+    def stats(self):
+        with self._lock:
+            self._expire()
+            return {
+                'queued': self._queue.qsize(),
+                'max_queued': self.max_queued,
+                'workers': self.num_workers,
+                'result_ttl_seconds': self.result_ttl,
+                'tracked_jobs': len(self._jobs),
+                'submitted': self.submitted,
+                'rejected': self.rejected,
+                'completed': self.completed,
+                'failed': self.failed,
+                'expired': self.expired,
+            }
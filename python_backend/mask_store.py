@@ -0,0 +1,230 @@
+"""
+Server-side store of decoded originals and their segmentation masks.
+/remove-background registers each cutout under a handle so /customize-product
+can composite new backgrounds without the client re-uploading pixels.
+Entries expire after a TTL (refreshed on access) and the least recently used
+ones are evicted when the memory cap is reached.
+
+With several worker processes the store can also spill entries to a shared
+directory, so a handle created by one worker can be used by any other.
+"""
+
+import os
+import time
+import logging
+import threading
+from collections import OrderedDict
+
+import numpy as np
+from PIL import Image
+
+logger = logging.getLogger('u2net-server')
+
+
+class MaskStore:
+    """TTL + memory-capped LRU store of (RGB image, L mask) pairs"""
+
+    def __init__(self, ttl_seconds=600, max_bytes=512 * 1024 * 1024, shared_dir=None):
+        self.ttl = ttl_seconds
+        self.max_bytes = max_bytes
+        self.shared_dir = shared_dir
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # handle -> (image, mask, size, expires_at)
+        self._bytes = 0
+        self._last_cleanup = 0.0
+        self.expirations = 0
+        self.evictions = 0
+        self.shared_hits = 0
+
+        if self.shared_dir:
+            os.makedirs(self.shared_dir, exist_ok=True)
+
+    @staticmethod
+    def _entry_size(image, mask):
+        return image.width * image.height * len(image.getbands()) + mask.width * mask.height
+
+    def put(self, handle, image, mask):
+        """Store the decoded original and its full-resolution mask under a handle"""
+        size = self._entry_size(image, mask)
+        if size > self.max_bytes:
+            logger.info(f"Image too large for the mask store ({size} bytes), not storing")
+            return False
+
+        with self._lock:
+            self._drop(handle)
+            self._entries[handle] = (image, mask, size, time.monotonic() + self.ttl)
+            self._bytes += size
+            self._expire()
+            while self._bytes > self.max_bytes:
+                oldest = next(iter(self._entries))
+                self._drop(oldest)
+                self.evictions += 1
+
+        if self.shared_dir:
+            self._write_shared(handle, image, mask)
+        return True
+
+    def get(self, handle):
+        """Return (image, mask) for a live handle and refresh its TTL, or None"""
+        entry = self._refresh_local(handle)
+        if entry is not None:
+            if self.shared_dir:
+                self._touch_shared(handle)
+            return entry[0], entry[1]
+
+        if not self.shared_dir:
+            return None
+
+        # Another worker may have created the handle
+        stored = self._read_shared(handle)
+        if stored is None:
+            return None
+        image, mask = stored
+        size = self._entry_size(image, mask)
+        with self._lock:
+            self.shared_hits += 1
+            self._drop(handle)
+            self._entries[handle] = (image, mask, size, time.monotonic() + self.ttl)
+            self._bytes += size
+            while self._bytes > self.max_bytes and len(self._entries) > 1:
+                self._drop(next(iter(self._entries)))
+                self.evictions += 1
+        return image, mask
+
+    def touch(self, handle):
+        """Refresh a handle's TTL, returning whether it is still stored"""
+        entry = self._refresh_local(handle)
+        if not self.shared_dir:
+            return entry is not None
+        # Refresh the shared file without loading it; another worker may own the handle
+        path = self._shared_path(handle)
+        if path is None:
+            return entry is not None
+        try:
+            if os.path.getmtime(path) + self.ttl < time.time():
+                return entry is not None
+            os.utime(path)
+        except OSError:
+            return entry is not None
+        return True
+
+    def _refresh_local(self, handle):
+        """Refresh the TTL of an in-memory entry, returning the entry or None"""
+        with self._lock:
+            self._expire()
+            entry = self._entries.get(handle)
+            if entry is not None:
+                image, mask, size, _ = entry
+                self._entries[handle] = (image, mask, size, time.monotonic() + self.ttl)
+                self._entries.move_to_end(handle)
+        return entry
+
+    def _shared_path(self, handle):
+        # Handles are hex digests, so they are safe to use as file names
+        if not all(c in '0123456789abcdef' for c in handle):
+            return None
+        return os.path.join(self.shared_dir, handle + '.npz')
+
+    def _write_shared(self, handle, image, mask):
+        path = self._shared_path(handle)
+        if path is None:
+            return
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp_path, 'wb') as f:
+                # Uncompressed: this is a scratch area, not long-term storage
+                np.savez(f, image=np.asarray(image), mask=np.asarray(mask))
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.error(f"Error writing shared mask entry {handle}: {e}")
+            return
+        self._cleanup_shared()
+
+    def _read_shared(self, handle):
+        path = self._shared_path(handle)
+        if path is None:
+            return None
+        try:
+            if os.path.getmtime(path) + self.ttl < time.time():
+                return None
+            with np.load(path) as data:
+                image = Image.fromarray(data['image'], 'RGB')
+                mask = Image.fromarray(data['mask'], 'L')
+            os.utime(path)  # Refresh the TTL for every worker
+        except (OSError, ValueError, KeyError):
+            return None
+        return image, mask
+
+    def _touch_shared(self, handle):
+        path = self._shared_path(handle)
+        if path is not None:
+            try:
+                os.utime(path)
+            except OSError:
+                pass
+
+    def _cleanup_shared(self):
+        """Delete expired shared entries and trim the directory to the memory cap"""
+        now = time.time()
+        if now - self._last_cleanup < max(1.0, self.ttl / 10):
+            return
+        self._last_cleanup = now
+
+        files = []
+        for name in os.listdir(self.shared_dir):
+            if not name.endswith('.npz'):
+                continue
+            path = os.path.join(self.shared_dir, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            if stat.st_mtime + self.ttl < now:
+                self._remove_file(path)
+            else:
+                files.append((stat.st_mtime, stat.st_size, path))
+
+        total = sum(size for _, size, _ in files)
+        for _, size, path in sorted(files):
+            if total <= self.max_bytes:
+                break
+            self._remove_file(path)
+            total -= size
+
+    @staticmethod
+    def _remove_file(path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def _drop(self, handle):
+        # Caller holds the lock
+        entry = self._entries.pop(handle, None)
+        if entry is not None:
+            self._bytes -= entry[2]
+
+    def _expire(self):
+        # Caller holds the lock. Entries are kept in access order, so expired
+        # ones always sit at the front.
+        now = time.monotonic()
+        while self._entries:
+            handle, entry = next(iter(self._entries.items()))
+            if entry[3] > now:
+                break
+            self._drop(handle)
+            self.expirations += 1
+
+    def stats(self):
+        with self._lock:
+            self._expire()
+            return {
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'max_bytes': self.max_bytes,
+                'ttl_seconds': self.ttl,
+                'expirations': self.expirations,
+                'evictions': self.evictions,
+                'shared_dir': self.shared_dir,
+                'shared_hits': self.shared_hits,
+            }
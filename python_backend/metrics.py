@@ -0,0 +1,225 @@
+"""
+Prometheus metrics for the inference server, rendered in the text exposition
+format without a client library.
+Metrics live in a registry per process. With several worker processes each
+worker publishes a snapshot of its registry to a shared directory, and
+/metrics merges them, labelling every series with its worker index.
+"""
+
+import os
+import json
+import time
+import logging
+import threading
+from contextlib import contextmanager
+
+logger = logging.getLogger('u2net-server')
+
+# Seconds, from a fast preprocessing step up to a large image on a busy CPU
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+               for value in labels.values())
+    return '{' + ','.join(f'{name}="{value}"' for name, value in zip(labels, escaped)) + '}'
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} takes labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def samples(self):
+        """[(name suffix, labels dict, value)] for the current values"""
+        with self._lock:
+            return [('', dict(zip(self.labelnames, key)), value) for key, value in self._values.items()]
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    """A gauge that is set directly or read from a callback when scraped"""
+    kind = 'gauge'
+
+    def __init__(self, name, documentation, labelnames=(), function=None):
+        super().__init__(name, documentation, labelnames)
+        self._function = function
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def samples(self):
+        if self._function is None:
+            return super().samples()
+        try:
+            value = self._function()
+        except Exception as e:
+            logger.error(f"Error reading gauge {self.name}: {e}")
+            return []
+        return [] if value is None else [('', {}, value)]
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float('inf'),)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            counts = self._values.get(key)
+            if counts is None:
+                # Per-bucket (non-cumulative) counts, then the sum
+                counts = self._values[key] = [0] * len(self.buckets) + [0.0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            counts[-1] += value
+
+    @contextmanager
+    def time(self, **labels):
+        """Observe the duration of the block in seconds"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def samples(self):
+        with self._lock:
+            values = [(key, list(counts)) for key, counts in self._values.items()]
+        samples = []
+        for key, counts in values:
+            labels = dict(zip(self.labelnames, key))
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                samples.append(('_bucket', {**labels, 'le': _format_value(bound)}, cumulative))
+            samples.append(('_sum', labels, counts[-1]))
+            samples.append(('_count', labels, cumulative))
+        return samples
+
+
+class MetricsRegistry:
+    """The metrics of one process"""
+
+    def __init__(self):
+        self._metrics = []
+
+    def _register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name, documentation, labelnames=(), function=None):
+        return self._register(Gauge(name, documentation, labelnames, function))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def snapshot(self):
+        """JSON-serializable copy of every metric's current samples"""
+        return [{'name': metric.name, 'help': metric.documentation, 'type': metric.kind,
+                 'samples': metric.samples()} for metric in self._metrics]
+
+    def publish(self, shared_dir, worker):
+        """Write this process's snapshot where the other workers can merge it"""
+        path = os.path.join(shared_dir, f"worker-{worker}.json")
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_path, 'w') as f:
+                json.dump({'worker': worker, 'metrics': self.snapshot()}, f)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.error(f"Error publishing metrics: {e}")
+
+    def start_publishing(self, shared_dir, worker, interval=5.0):
+        """Publish a snapshot every `interval` seconds from a daemon thread"""
+        os.makedirs(shared_dir, exist_ok=True)
+
+        def loop():
+            while True:
+                self.publish(shared_dir, worker)
+                time.sleep(interval)
+
+        threading.Thread(target=loop, name='metrics-publisher', daemon=True).start()
+
+    def render(self, shared_dir=None, worker=None):
+        """Prometheus text format for this process, or for every worker publishing to shared_dir"""
+        if shared_dir is None or worker is None:
+            return render_snapshots([(None, self.snapshot())])
+
+        snapshots = {worker: self.snapshot()}
+        for name in sorted(os.listdir(shared_dir)):
+            if not name.startswith('worker-') or not name.endswith('.json'):
+                continue
+            try:
+                with open(os.path.join(shared_dir, name)) as f:
+                    published = json.load(f)
+            except (OSError, ValueError):
+                continue
+            snapshots.setdefault(published['worker'], published['metrics'])
+        return render_snapshots(sorted(snapshots.items()))
+
+
+def render_snapshots(snapshots):
+    """Render [(worker, snapshot)] pairs; series get a worker label unless worker is None"""
+    families = {}
+    for worker, snapshot in snapshots:
+        for metric in snapshot:
+            family = families.setdefault(metric['name'], {**metric, 'samples': []})
+            for suffix, labels, value in metric['samples']:
+                if worker is not None:
+                    labels = {'worker': worker, **labels}
+                family['samples'].append((suffix, labels, value))
+
+    lines = []
+    for family in families.values():
+        lines.append(f"# HELP {family['name']} {family['help']}")
+        lines.append(f"# TYPE {family['name']} {family['type']}")
+        for suffix, labels, value in family['samples']:
+            lines.append(f"{family['name']}{suffix}{_format_labels(labels)} {_format_value(value)}")
+    return '\n'.join(lines) + '\n'
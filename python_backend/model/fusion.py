@@ -0,0 +1,72 @@
+"""
+Deployment transforms for U2NET/U2NETP.
+fuse_model folds every BatchNorm into the convolution in front of it and folds
+the ImageNet input normalization into the first convolution, so the fused
+model runs one kernel less per REBNCONV and takes RGB tensors scaled 0-255
+directly.
+"""
+
+import copy
+
+import torch
+import torch.nn as nn
+from torch.nn.utils.fusion import fuse_conv_bn_eval
+
+from .u2net import REBNCONV
+
+IMAGENET_MEAN = (0.485, 0.456, 0.406)
+IMAGENET_STD = (0.229, 0.224, 0.225)
+
+
+class InputShift(nn.Module):
+    """Subtract a per-channel offset from the input.
+
+    The mean can't be folded into the first conv's bias exactly because that
+    conv zero-pads its input, so it stays as a single broadcast subtraction.
+    """
+
+    def __init__(self, offset):
+        super(InputShift, self).__init__()
+        self.register_buffer('offset', offset.reshape(1, -1, 1, 1))
+
+    def forward(self, x):
+        return x - self.offset
+
+
+def fuse_model(net, mean=IMAGENET_MEAN, std=IMAGENET_STD, input_scale=255.0):
+    """Return a fused copy of an eval-mode U2NET/U2NETP that takes unnormalized input.
+
+    The copy computes net((x / input_scale - mean) / std) for inputs x in
+    [0, input_scale], and has its raw_input attribute set.
+    """
+    fused = copy.deepcopy(net).eval()
+
+    with torch.no_grad():
+        for module in fused.modules():
+            if isinstance(module, REBNCONV):
+                module.conv_s1 = fuse_conv_bn_eval(module.conv_s1, module.bn_s1)
+                module.bn_s1 = nn.Identity()
+
+        # (x / s - m) / d == (x - s * m) / (s * d): the division goes into the
+        # first conv's weights (per input channel), the shift in front of it
+        first = fused.stage1.rebnconvin.conv_s1
+        device = first.weight.device
+        first.weight.div_((torch.tensor(std, device=device) * input_scale).reshape(1, -1, 1, 1))
+        offset = torch.tensor(mean, device=device) * input_scale
+
+    fused.stage1 = nn.Sequential(InputShift(offset), fused.stage1)
+    fused.raw_input = True
+    return fused
+
+
+def fusion_parity(net, fused, batch_size=1, mean=IMAGENET_MEAN, std=IMAGENET_STD, input_scale=255.0):
+    """Largest difference between the fused predictions of net and fused on random input"""
+    device = next(net.parameters()).device
+    raw = torch.rand(batch_size, 3, 320, 320, device=device) * input_scale
+    mean = torch.tensor(mean, device=device).reshape(1, -1, 1, 1)
+    std = torch.tensor(std, device=device).reshape(1, -1, 1, 1)
+
+    with torch.no_grad():
+        expected = net.predict((raw / input_scale - mean) / std)
+        actual = fused.predict(raw)
+    return (expected - actual).abs().max().item()
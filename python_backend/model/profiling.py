@@ -0,0 +1,149 @@
+"""
+Opt-in layer profiling for U2NET/U2NETP.
+While a LayerProfiler is active, forward hooks record the wall time, an
+estimate of the convolution FLOPs and the output tensor size of every
+module down to the requested depth (depth 1 = the RSU stages, side outputs
+and outconv; depth 2 adds the layers inside each RSU). Results are
+available as a table, a JSON-friendly summary or a Chrome trace
+(chrome://tracing or https://ui.perfetto.dev).
+
+Only calls made from the thread that entered the profiler are recorded, so
+a model shared with other request threads can be profiled in place.
+"""
+
+import time
+import threading
+
+import torch
+import torch.nn as nn
+
+# Summary sort orders -> summary field
+SORT_KEYS = {'time': 'seconds', 'flops': 'flops', 'memory': 'output_bytes'}
+
+
+def conv_flops(module, output):
+    """FLOPs of a Conv2d call (one multiply-add counted as two)"""
+    kernel_ops = (module.in_channels // module.groups) * module.kernel_size[0] * module.kernel_size[1]
+    return 2 * output.numel() * kernel_ops
+
+
+def tensor_bytes(value):
+    """Total size of the tensors in a module output"""
+    if isinstance(value, torch.Tensor):
+        return value.numel() * value.element_size()
+    if isinstance(value, (tuple, list)):
+        return sum(tensor_bytes(v) for v in value)
+    return 0
+
+
+class LayerProfiler:
+    """Context manager recording per-module forward time, FLOPs and output bytes"""
+
+    def __init__(self, net, depth=1):
+        self.net = net
+        self.depth = depth
+        self.events = []
+        self.elapsed = 0.0
+        self._handles = []
+        self._stack = []
+        self._thread = None
+        self._start = None
+
+    def _sync(self, value):
+        if isinstance(value, torch.Tensor) and value.is_cuda:
+            torch.cuda.synchronize(value.device)
+
+    def _pre_hook(self, name):
+        def hook(module, inputs):
+            if threading.get_ident() != self._thread:
+                return
+            self._sync(inputs[0] if inputs else None)
+            self._stack.append({'name': name, 'type': type(module).__name__, 'depth': name.count('.') + 1,
+                                'start': time.perf_counter(), 'flops': 0})
+        return hook
+
+    def _post_hook(self, module, inputs, output):
+        if threading.get_ident() != self._thread:
+            return
+        self._sync(output)
+        event = self._stack.pop()
+        event['duration'] = time.perf_counter() - event['start']
+        event['output_bytes'] = tensor_bytes(output)
+        self.events.append(event)
+
+    def _conv_hook(self, module, inputs, output):
+        if threading.get_ident() != self._thread:
+            return
+        # Credit the convolution to every profiled module it runs inside
+        flops = conv_flops(module, output)
+        for event in self._stack:
+            event['flops'] += flops
+
+    def __enter__(self):
+        self._thread = threading.get_ident()
+        # Forward hooks run in registration order, so the FLOPs hooks go first
+        # and a profiled Conv2d is credited before its own event is closed
+        for module in self.net.modules():
+            if isinstance(module, nn.Conv2d):
+                self._handles.append(module.register_forward_hook(self._conv_hook))
+        for name, module in self.net.named_modules():
+            if name and name.count('.') < self.depth:
+                self._handles.append(module.register_forward_pre_hook(self._pre_hook(name)))
+                self._handles.append(module.register_forward_hook(self._post_hook))
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.elapsed += time.perf_counter() - self._start
+        for handle in self._handles:
+            handle.remove()
+        self._handles = []
+        self._stack = []
+        return False
+
+    def summary(self, sort=None):
+        """Per-module totals in execution order, or sorted by 'time', 'flops' or 'memory' (largest first)"""
+        modules = {}
+        for event in sorted(self.events, key=lambda e: e['start']):
+            entry = modules.setdefault(event['name'], {
+                'name': event['name'], 'type': event['type'], 'depth': event['depth'],
+                'calls': 0, 'seconds': 0.0, 'flops': 0, 'output_bytes': 0})
+            entry['calls'] += 1
+            entry['seconds'] += event['duration']
+            entry['flops'] += event['flops']
+            entry['output_bytes'] += event['output_bytes']
+        for entry in modules.values():
+            entry['share'] = entry['seconds'] / self.elapsed if self.elapsed else 0.0
+        rows = list(modules.values())
+        if sort:
+            rows.sort(key=lambda row: row[SORT_KEYS[sort]], reverse=True)
+        return rows
+
+    def table(self, sort=None):
+        """Text table of the summary; sort by 'time', 'flops' or 'memory' (default: execution order)"""
+        rows = self.summary(sort)
+        lines = [f"{'module':<24} {'type':<10} {'calls':>5} {'ms/call':>9} {'share':>7} "
+                 f"{'GFLOP/call':>10} {'out MB/call':>11}"]
+        for row in rows:
+            calls = row['calls']
+            name = '  ' * (row['depth'] - 1) + row['name'] if not sort else row['name']
+            lines.append(f"{name:<24} {row['type']:<10} {calls:>5} {row['seconds'] * 1000 / calls:>9.2f} "
+                         f"{row['share']:>6.1%} {row['flops'] / calls / 1e9:>10.2f} "
+                         f"{row['output_bytes'] / calls / (1024 * 1024):>11.2f}")
+        lines.append(f"total profiled time {self.elapsed * 1000:.1f} ms")
+        return '\n'.join(lines)
+
+    def chrome_trace(self):
+        """The recorded calls in Chrome trace event format"""
+        origin = self._start if not self.events else min(e['start'] for e in self.events)
+        events = [{
+            'name': event['name'],
+            'cat': event['type'],
+            'ph': 'X',
+            'ts': (event['start'] - origin) * 1e6,
+            'dur': event['duration'] * 1e6,
+            'pid': 0,
+            'tid': 0,
+            'args': {'flops': event['flops'], 'output_bytes': event['output_bytes']},
+        } for event in self.events]
+        return {'traceEvents': events, 'displayTimeUnit': 'ms'}
@@ -2,6 +2,8 @@ import torch
 import torch.nn as nn
 import torch.nn.functional as F
 
+from .profiling import LayerProfiler
+
 class REBNCONV(nn.Module):
     def __init__(self,in_ch=3,out_ch=3,dirate=1):
         super(REBNCONV,self).__init__()
@@ -314,8 +316,40 @@ class RSU4F(nn.Module):#UNet04FRES(nn.Module):
         return hx1d + hxin
 
 
+### inference-only prediction shared by U2NET and U2NETP ###
+class _U2NETBase(nn.Module):
+
+    def predict(self,x,output='d0'):
+        """Return only sigmoid(d0) (fused) or sigmoid(d1), skipping the side outputs that aren't needed"""
+
+        hx1d,hx2d,hx3d,hx4d,hx5d,hx6 = self._decode(x)
+
+        d1 = self.side1(hx1d)
+        if output == 'd1':
+            return torch.sigmoid_(d1)
+        if output != 'd0':
+            raise ValueError("output must be 'd0' or 'd1'")
+
+        # outconv over the concatenated side outputs is a sum of per-side 1x1
+        # convs, and both the convs and the bilinear upsample are linear, so
+        # each side is reduced at its own resolution and accumulated into d0
+        # instead of upsampling all of them and building the concat
+        n = d1.shape[1]
+        weight = self.outconv.weight
+        d0 = F.conv2d(d1,weight[:,:n],self.outconv.bias)
+        sides = ((self.side2,hx2d),(self.side3,hx3d),(self.side4,hx4d),(self.side5,hx5d),(self.side6,hx6))
+        for i,(side,hx) in enumerate(sides,1):
+            d0 += _upsample_like(F.conv2d(side(hx),weight[:,i*n:(i+1)*n]),d1)
+
+        return torch.sigmoid_(d0)
+
+    def profile(self,depth=1):
+        """Context manager recording per-module time, FLOPs and output bytes of the calls made inside it"""
+
+        return LayerProfiler(self,depth)
+
 ##### U^2-Net ####
-class U2NET(nn.Module):
+class U2NET(_U2NETBase):
 
     def __init__(self,in_ch=3,out_ch=1):
         super(U2NET,self).__init__()
@@ -353,7 +387,7 @@ class U2NET(nn.Module):
 
         self.outconv = nn.Conv2d(6*out_ch,out_ch,1)
 
-    def forward(self,x):
+    def _decode(self,x):
 
         hx = x
 
@@ -396,6 +430,11 @@ class U2NET(nn.Module):
 
         hx1d = self.stage1d(torch.cat((hx2dup,hx1),1))
 
+        return hx1d,hx2d,hx3d,hx4d,hx5d,hx6
+
+    def forward(self,x):
+
+        hx1d,hx2d,hx3d,hx4d,hx5d,hx6 = self._decode(x)
 
         #side output
         d1 = self.side1(hx1d)
@@ -420,7 +459,7 @@ class U2NET(nn.Module):
         return F.sigmoid(d0), F.sigmoid(d1), F.sigmoid(d2), F.sigmoid(d3), F.sigmoid(d4), F.sigmoid(d5), F.sigmoid(d6)
 
 ### U^2-Net small ###
-class U2NETP(nn.Module):
+class U2NETP(_U2NETBase):
 
     def __init__(self,in_ch=3,out_ch=1):
         super(U2NETP,self).__init__()
@@ -458,7 +497,7 @@ class U2NETP(nn.Module):
 
         self.outconv = nn.Conv2d(6*out_ch,out_ch,1)
 
-    def forward(self,x):
+    def _decode(self,x):
 
         hx = x
 
@@ -501,6 +540,11 @@ class U2NETP(nn.Module):
 
         hx1d = self.stage1d(torch.cat((hx2dup,hx1),1))
 
+        return hx1d,hx2d,hx3d,hx4d,hx5d,hx6
+
+    def forward(self,x):
+
+        hx1d,hx2d,hx3d,hx4d,hx5d,hx6 = self._decode(x)
 
         #side output
         d1 = self.side1(hx1d)
@@ -0,0 +1,187 @@
+"""
+Pre-forked multi-process serving for the U-2-Net server.
+The parent loads the model once, opens the listening socket and forks the
+workers, so every worker shares the weight pages copy-on-write instead of
+loading its own copy of the state dict. Each worker runs its own threaded
+Werkzeug server on the inherited socket.
+"""
+
+import os
+import gc
+import sys
+import time
+import signal
+import socket
+import logging
+
+from werkzeug.serving import make_server
+
+logger = logging.getLogger('u2net-server')
+
+
+def process_memory(pid):
+    """Return RSS/PSS/shared memory of a process in bytes (Linux /proc based)"""
+    memory = {'pid': pid, 'rss': None, 'pss': None, 'shared': None}
+    try:
+        with open(f'/proc/{pid}/smaps_rollup') as f:
+            fields = {}
+            for line in f:
+                parts = line.split()
+                if len(parts) == 3 and parts[2] == 'kB':
+                    fields[parts[0].rstrip(':')] = int(parts[1]) * 1024
+        memory['rss'] = fields.get('Rss')
+        memory['pss'] = fields.get('Pss')
+        memory['shared'] = fields.get('Shared_Clean', 0) + fields.get('Shared_Dirty', 0)
+        return memory
+    except (OSError, ValueError):
+        pass
+
+    # Older kernels: fall back to VmRSS only
+    try:
+        with open(f'/proc/{pid}/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    memory['rss'] = int(line.split()[1]) * 1024
+    except (OSError, ValueError):
+        pass
+    return memory
+
+
+def sibling_worker_pids():
+    """PIDs of all workers forked by this worker's parent"""
+    ppid = os.getppid()
+    try:
+        with open(f'/proc/{ppid}/task/{ppid}/children') as f:
+            return [int(pid) for pid in f.read().split()]
+    except (OSError, ValueError):
+        return [os.getpid()]
+
+
+def _format_mb(value):
+    return f"{value / (1024 * 1024):.0f} MB" if value is not None else "n/a"
+
+
+class PreforkServer:
+    """Fork `num_workers` copies of the app around one listening socket"""
+
+    def __init__(self, app, host, port, num_workers, init_worker=None, rss_report_interval=60):
+        self.app = app
+        self.host = host
+        self.port = port
+        self.num_workers = num_workers
+        # Called in each worker right after the fork with the worker index
+        self.init_worker = init_worker
+        self.rss_report_interval = rss_report_interval
+        self.workers = {}  # pid -> worker index
+        self.sock = None
+        self._stopping = False
+
+    def _open_socket(self):
+        family = socket.AF_INET6 if ':' in self.host else socket.AF_INET
+        sock = socket.socket(family, socket.SOCK_STREAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.bind((self.host, self.port))
+        sock.listen(128)
+        sock.set_inheritable(True)
+        return sock
+
+    def _spawn(self, index):
+        pid = os.fork()
+        if pid:
+            self.workers[pid] = index
+            return
+
+        # Worker process
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        signal.signal(signal.SIGINT, signal.SIG_DFL)
+        exit_code = 0
+        try:
+            if self.init_worker is not None:
+                self.init_worker(index)
+            server = make_server(self.host, self.port, self.app, threaded=True, fd=self.sock.fileno())
+            logger.info(f"Worker {index} (pid {os.getpid()}) serving on http://{self.host}:{self.port}")
+            server.serve_forever()
+        except Exception as e:
+            logger.error(f"Worker {index} crashed: {e}")
+            exit_code = 1
+        finally:
+            os._exit(exit_code)
+
+    def _handle_stop(self, signum, frame):
+        self._stopping = True
+
+    def _report_memory(self):
+        for pid, index in sorted(self.workers.items(), key=lambda item: item[1]):
+            memory = process_memory(pid)
+            logger.info(f"Worker {index} (pid {pid}): RSS {_format_mb(memory['rss'])}, "
+                        f"PSS {_format_mb(memory['pss'])}, shared {_format_mb(memory['shared'])}")
+
+    def serve_forever(self):
+        self.sock = self._open_socket()
+
+        # Move everything allocated so far (model included) out of the GC's
+        # reach so collections in the workers don't dirty the shared pages
+        gc.collect()
+        gc.freeze()
+
+        for index in range(self.num_workers):
+            self._spawn(index)
+
+        signal.signal(signal.SIGTERM, self._handle_stop)
+        signal.signal(signal.SIGINT, self._handle_stop)
+        logger.info(f"Started {self.num_workers} workers on http://{self.host}:{self.port}")
+
+        next_report = time.monotonic() + self.rss_report_interval
+        try:
+            while not self._stopping:
+                try:
+                    pid, status = os.waitpid(-1, os.WNOHANG)
+                except ChildProcessError:
+                    break
+
+                if pid:
+                    # Replace workers that died unexpectedly
+                    index = self.workers.pop(pid, None)
+                    if index is not None and not self._stopping:
+                        logger.error(f"Worker {index} (pid {pid}) exited with status {status}, restarting")
+                        self._spawn(index)
+                    continue
+
+                if self.rss_report_interval > 0 and time.monotonic() >= next_report:
+                    self._report_memory()
+                    next_report = time.monotonic() + self.rss_report_interval
+
+                time.sleep(0.5)
+        finally:
+            self.shutdown()
+
+    def shutdown(self, timeout=10):
+        logger.info("Shutting down workers...")
+        for pid in list(self.workers):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                self.workers.pop(pid, None)
+
+        deadline = time.monotonic() + timeout
+        while self.workers and time.monotonic() < deadline:
+            try:
+                pid, _ = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                break
+            if pid:
+                self.workers.pop(pid, None)
+            else:
+                time.sleep(0.1)
+
+        for pid in list(self.workers):
+            try:
+                os.kill(pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+        self.workers.clear()
+
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+        sys.stdout.flush()
@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+"""
+Per-layer profile of U2NET/U2NETP: wall time, estimated convolution FLOPs
+and output tensor size of every RSU stage (and, with --depth 2, of the
+layers inside them), as a table and optionally as a Chrome trace.
+
+Usage:
+    python profile_model.py [--model u2net] [--image photo.jpg] [--depth 1] [--sort time] [--trace trace.json]
+"""
+
+import sys
+import json
+import logging
+import argparse
+
+import torch
+
+from inference import CustomRescale, MODEL_ARCHITECTURES, load_model
+from model.profiling import SORT_KEYS
+
+# Set up logging to console
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    handlers=[
+        logging.StreamHandler(sys.stdout)
+    ]
+)
+logger = logging.getLogger('profile-model')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Profile the U-2-Net layers')
+    parser.add_argument('--model', type=str, default='u2net', choices=sorted(MODEL_ARCHITECTURES),
+                        help='Model to profile')
+    parser.add_argument('--random-weights', action='store_true',
+                        help='Profile an untrained model (timings and FLOPs do not depend on the weights)')
+    parser.add_argument('--image', type=str, default=None, help='Input image (default: random input)')
+    parser.add_argument('--batch-size', type=int, default=1)
+    parser.add_argument('--runs', type=int, default=3, help='Profiled forward passes, after one warmup pass')
+    parser.add_argument('--depth', type=int, default=1,
+                        help='1 profiles the RSU stages, 2 also the layers inside them')
+    parser.add_argument('--forward', action='store_true',
+                        help='Profile forward() with all side outputs instead of the predict() path the server uses')
+    parser.add_argument('--sort', type=str, default=None, choices=sorted(SORT_KEYS),
+                        help='Sort the table (default: execution order)')
+    parser.add_argument('--trace', type=str, default=None, help='Write a Chrome trace to this path')
+    parser.add_argument('--threads', type=int, default=0, help='torch threads (0 keeps the default)')
+    args = parser.parse_args()
+
+    if args.threads > 0:
+        torch.set_num_threads(args.threads)
+
+    if args.random_weights:
+        net = MODEL_ARCHITECTURES[args.model](3, 1).eval()
+    else:
+        net = load_model(args.model)
+        if net is None:
+            logger.error("Failed to load model. Exiting.")
+            return 1
+    device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+    net = net.to(device)
+
+    if args.image:
+        from PIL import Image
+        inputs = CustomRescale(320)(Image.open(args.image).convert('RGB')).unsqueeze(0)
+        inputs = inputs.repeat(args.batch_size, 1, 1, 1)
+    else:
+        inputs = torch.rand(args.batch_size, 3, 320, 320)
+    inputs = inputs.to(device)
+
+    call = (lambda: net(inputs)) if args.forward else (lambda: net.predict(inputs))
+    with torch.no_grad():
+        call()
+        with net.profile(depth=args.depth) as profiler:
+            for _ in range(args.runs):
+                call()
+
+    print(f"{args.model}, batch {args.batch_size}, {device.type}, {args.runs} runs, "
+          f"{'forward' if args.forward else 'predict'}")
+    print(profiler.table(sort=args.sort))
+
+    if args.trace:
+        with open(args.trace, 'w') as f:
+            json.dump(profiler.chrome_trace(), f)
+        logger.info(f"Wrote Chrome trace to {args.trace}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,155 @@
+#!/usr/bin/env python
+"""
+Post-training int8 quantization of the U-2-Net models.
+Exports the fp32 model to ONNX and quantizes it with ONNX Runtime, either
+dynamically (weights quantized ahead of time, activation ranges computed per
+batch) or statically (activation ranges calibrated on a folder of images).
+The result is written next to the fp32 weights as
+saved_models/<model>/<model>_int8_<mode>.onnx and is served with
+--model <model>_int8_<mode>.
+
+Size, latency and mask MAE against the fp32 model are reported on the
+calibration folder (or on --eval-dir).
+
+Usage:
+    python quantize_model.py --model u2net --mode static --calibration-dir IMAGES [--calibration-count 64]
+"""
+
+import os
+import sys
+import time
+import logging
+import argparse
+import tempfile
+
+import torch
+
+from archive_io import IMAGE_EXTENSIONS
+from inference import (CustomRescale, MODEL_ARCHITECTURES, QUANTIZATION_MODES, OnnxModel, load_model,
+                       export_onnx, onnx_model_path, quantized_model_path, model_weights_path,
+                       compare_outputs, run_model)
+
+# Set up logging to console
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    handlers=[
+        logging.StreamHandler(sys.stdout)
+    ]
+)
+logger = logging.getLogger('quantize-model')
+
+
+def load_folder(folder, count):
+    """Preprocess up to `count` images from a folder into a (N, 3, 320, 320) batch"""
+    from PIL import Image
+    transform = CustomRescale(320)
+    names = sorted(n for n in os.listdir(folder) if os.path.splitext(n)[1].lower() in IMAGE_EXTENSIONS)
+    tensors = [transform(Image.open(os.path.join(folder, name)).convert('RGB')) for name in names[:count]]
+    if not tensors:
+        raise ValueError(f"No images found in {folder}")
+    return torch.stack(tensors)
+
+
+def quantize(fp32_path, output_path, mode, calibration=None, per_channel=True):
+    """Quantize an fp32 ONNX model to int8; static mode needs a calibration batch"""
+    from onnxruntime.quantization import (CalibrationDataReader, QuantFormat, QuantType,
+                                          quantize_dynamic, quantize_static, quant_pre_process)
+
+    class FolderReader(CalibrationDataReader):
+        def __init__(self, inputs):
+            self._inputs = iter(inputs)
+
+        def get_next(self):
+            tensor = next(self._inputs, None)
+            return None if tensor is None else {'input': tensor.unsqueeze(0).numpy()}
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        # Shape inference and graph cleanup so more nodes can be quantized
+        prepared_path = os.path.join(tmp_dir, 'prepared.onnx')
+        quant_pre_process(fp32_path, prepared_path)
+
+        tmp_path = f"{output_path}.{os.getpid()}.tmp"
+        if mode == 'dynamic':
+            quantize_dynamic(prepared_path, tmp_path, per_channel=per_channel, weight_type=QuantType.QInt8)
+        else:
+            quantize_static(prepared_path, tmp_path, FolderReader(calibration),
+                            quant_format=QuantFormat.QDQ, per_channel=per_channel,
+                            activation_type=QuantType.QUInt8, weight_type=QuantType.QInt8)
+        os.replace(tmp_path, output_path)
+    return output_path
+
+
+def time_model(net, inputs, repeat):
+    run_model(net, inputs[:1])
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for tensor in inputs:
+            run_model(net, tensor.unsqueeze(0))
+    return (time.perf_counter() - start) / (repeat * len(inputs))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Create int8 variants of the U-2-Net models')
+    parser.add_argument('--model', type=str, default='u2net', choices=sorted(MODEL_ARCHITECTURES),
+                        help='fp32 model to quantize')
+    parser.add_argument('--mode', type=str, default='static', choices=QUANTIZATION_MODES,
+                        help='Dynamic (no calibration) or static (calibrated activations) quantization')
+    parser.add_argument('--calibration-dir', type=str, default=None,
+                        help='Folder of representative images (required for static mode)')
+    parser.add_argument('--calibration-count', type=int, default=64, help='Images used for calibration')
+    parser.add_argument('--eval-dir', type=str, default=None,
+                        help='Folder for the fp32 comparison (default: the calibration folder)')
+    parser.add_argument('--eval-count', type=int, default=16, help='Images used for the fp32 comparison')
+    parser.add_argument('--per-tensor', action='store_true',
+                        help='One scale per weight tensor instead of per output channel')
+    parser.add_argument('--threads', type=int, default=0, help='ONNX Runtime intra-op threads (0 = default)')
+    parser.add_argument('--repeat', type=int, default=2, help='Timed passes over the evaluation images')
+    args = parser.parse_args()
+
+    if args.mode == 'static' and not args.calibration_dir:
+        parser.error('--calibration-dir is required for static quantization')
+
+    net = load_model(args.model)
+    if net is None:
+        logger.error("Failed to load model. Exiting.")
+        return 1
+
+    fp32_path = onnx_model_path(args.model)
+    if not os.path.exists(fp32_path) or os.path.getmtime(model_weights_path(args.model)) > os.path.getmtime(fp32_path):
+        export_onnx(net, fp32_path)
+
+    calibration = None
+    if args.mode == 'static':
+        calibration = load_folder(args.calibration_dir, args.calibration_count)
+        logger.info(f"Calibrating on {len(calibration)} images from {args.calibration_dir}")
+
+    output_path = quantize(fp32_path, quantized_model_path(args.model, args.mode), args.mode,
+                           calibration=calibration, per_channel=not args.per_tensor)
+    logger.info(f"Wrote {output_path}")
+
+    # Compare against fp32 on real images if we have them, random inputs otherwise
+    eval_dir = args.eval_dir or args.calibration_dir
+    inputs = load_folder(eval_dir, args.eval_count) if eval_dir else torch.rand(args.eval_count, 3, 320, 320)
+    int8_net = OnnxModel(output_path, intra_op_threads=args.threads)
+    fp32_onnx = OnnxModel(fp32_path, intra_op_threads=args.threads)
+
+    fp32_size = os.path.getsize(model_weights_path(args.model))
+    int8_size = os.path.getsize(output_path)
+    torch_time = time_model(net, inputs, args.repeat)
+    fp32_time = time_model(fp32_onnx, inputs, args.repeat)
+    int8_time = time_model(int8_net, inputs, args.repeat)
+    deltas = compare_outputs(net, int8_net, inputs)
+
+    logger.info(f"Size: fp32 {fp32_size / (1024 * 1024):.1f} MB, int8 {int8_size / (1024 * 1024):.1f} MB "
+                f"({int8_size / fp32_size:.0%})")
+    logger.info(f"Latency per image: torch fp32 {torch_time * 1000:.0f} ms, "
+                f"onnxruntime fp32 {fp32_time * 1000:.0f} ms, int8 {int8_time * 1000:.0f} ms "
+                f"({fp32_time / int8_time:.2f}x vs onnxruntime fp32)")
+    logger.info(f"Mask MAE vs fp32 on {len(inputs)} images: {deltas['mask_mae']:.4f} "
+                f"(max raw difference {deltas['max_abs_diff']:.3f})")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
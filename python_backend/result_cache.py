@@ -0,0 +1,188 @@
+"""
+Content-addressed cache for background removal results.
+Entries are keyed on a hash of the uploaded image bytes plus the model name and
+processing parameters. A bounded in-memory LRU tier sits in front of an
+optional on-disk tier with its own size cap.
+"""
+
+import os
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+
+logger = logging.getLogger('u2net-server')
+
+
+def make_cache_key(image_bytes, model_name, **params):
+    """Build a cache key from the image bytes, model name and processing parameters"""
+    digest = hashlib.sha256()
+    digest.update(image_bytes)
+    digest.update(model_name.encode('utf-8'))
+    for name in sorted(params):
+        digest.update(f"|{name}={params[name]}".encode('utf-8'))
+    return digest.hexdigest()
+
+
+class ResultCache:
+    """Two-tier (memory + optional disk) LRU cache of encoded results"""
+
+    def __init__(self, max_memory_bytes=256 * 1024 * 1024, disk_dir=None,
+                 max_disk_bytes=1024 * 1024 * 1024):
+        self.max_memory_bytes = max_memory_bytes
+        self.disk_dir = disk_dir
+        self.max_disk_bytes = max_disk_bytes
+
+        self._lock = threading.Lock()
+        self._memory = OrderedDict()  # key -> bytes, oldest first
+        self._memory_bytes = 0
+        self._disk = OrderedDict()    # key -> size on disk, oldest first
+        self._disk_bytes = 0
+
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.memory_evictions = 0
+        self.disk_evictions = 0
+
+        if self.disk_dir:
+            os.makedirs(self.disk_dir, exist_ok=True)
+            self._load_disk_index()
+
+    def _disk_path(self, key):
+        return os.path.join(self.disk_dir, key[:2], key + '.bin')
+
+    def _load_disk_index(self):
+        """Rebuild the disk LRU order from file modification times"""
+        entries = []
+        for root, _, files in os.walk(self.disk_dir):
+            for name in files:
+                if not name.endswith('.bin'):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, name[:-4], stat.st_size))
+
+        for _, key, size in sorted(entries):
+            self._disk[key] = size
+            self._disk_bytes += size
+        self._evict_disk()
+        logger.info(f"Result cache disk tier: {len(self._disk)} entries, "
+                    f"{self._disk_bytes / (1024 * 1024):.1f} MB in {self.disk_dir}")
+
+    def get(self, key):
+        """Return the cached bytes for a key, or None on a miss"""
+        with self._lock:
+            value = self._memory.get(key)
+            if value is not None:
+                self._memory.move_to_end(key)
+                self.memory_hits += 1
+                return value
+
+            on_disk = key in self._disk
+
+        if on_disk:
+            value = self._read_disk(key)
+            if value is not None:
+                with self._lock:
+                    self.disk_hits += 1
+                    self._put_memory(key, value)
+                return value
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, key, value):
+        """Store encoded result bytes in both tiers"""
+        with self._lock:
+            self._put_memory(key, value)
+        if self.disk_dir:
+            self._write_disk(key, value)
+
+    def _put_memory(self, key, value):
+        # Caller holds the lock
+        if len(value) > self.max_memory_bytes:
+            return
+        old = self._memory.pop(key, None)
+        if old is not None:
+            self._memory_bytes -= len(old)
+        self._memory[key] = value
+        self._memory_bytes += len(value)
+        while self._memory_bytes > self.max_memory_bytes:
+            _, evicted = self._memory.popitem(last=False)
+            self._memory_bytes -= len(evicted)
+            self.memory_evictions += 1
+
+    def _read_disk(self, key):
+        path = self._disk_path(key)
+        try:
+            with open(path, 'rb') as f:
+                value = f.read()
+            os.utime(path)  # Keep the on-disk LRU order across restarts
+        except OSError:
+            with self._lock:
+                size = self._disk.pop(key, None)
+                if size is not None:
+                    self._disk_bytes -= size
+            return None
+
+        with self._lock:
+            if key in self._disk:
+                self._disk.move_to_end(key)
+        return value
+
+    def _write_disk(self, key, value):
+        if len(value) > self.max_disk_bytes:
+            return
+        path = self._disk_path(key)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(tmp_path, 'wb') as f:
+                f.write(value)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.error(f"Error writing cache entry {key}: {e}")
+            return
+
+        with self._lock:
+            old = self._disk.pop(key, None)
+            if old is not None:
+                self._disk_bytes -= old
+            self._disk[key] = len(value)
+            self._disk_bytes += len(value)
+            self._evict_disk()
+
+    def _evict_disk(self):
+        # Caller holds the lock (or is the constructor)
+        while self._disk_bytes > self.max_disk_bytes and self._disk:
+            key, size = self._disk.popitem(last=False)
+            self._disk_bytes -= size
+            self.disk_evictions += 1
+            try:
+                os.remove(self._disk_path(key))
+            except OSError:
+                pass
+
+    def stats(self):
+        with self._lock:
+            hits = self.memory_hits + self.disk_hits
+            lookups = hits + self.misses
+            return {
+                'memory_entries': len(self._memory),
+                'memory_bytes': self._memory_bytes,
+                'max_memory_bytes': self.max_memory_bytes,
+                'disk_entries': len(self._disk),
+                'disk_bytes': self._disk_bytes,
+                'max_disk_bytes': self.max_disk_bytes if self.disk_dir else 0,
+                'memory_hits': self.memory_hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses,
+                'memory_evictions': self.memory_evictions,
+                'disk_evictions': self.disk_evictions,
+                'hit_rate': hits / lookups if lookups else 0.0,
+            }
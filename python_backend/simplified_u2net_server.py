@@ -1,25 +1,30 @@
 import os
 import sys
 import base64
-import io
-from PIL import Image
-import numpy as np
+from PIL import Image, UnidentifiedImageError
 import torch
-from torch.autograd import Variable
 import torchvision.transforms as transforms
-from flask import Flask, request, jsonify, render_template_string, Response
+from flask import Flask, request, jsonify, render_template_string, Response, stream_with_context, g
 from flask_cors import CORS
+from werkzeug.exceptions import RequestEntityTooLarge
 import logging
 import argparse
 import json
+import tarfile
+import zipfile
+import shutil
+import tempfile
 import random
 import time
+import contextlib
+import atexit
+import threading
 import torch.nn.functional as F
 
 # Initialize Flask app and configure CORS
 app = Flask(__name__)
 # Enable CORS for all routes and all origins
-CORS(app, resources={r"/*": {"origins": "*"}})
+CORS(app, resources={r"/*": {"origins": "*"}}, expose_headers=['X-Mask-Handle', 'X-Mask-Width', 'X-Mask-Height'])
 
 # Enable logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
@@ -30,9 +35,87 @@ parser = argparse.ArgumentParser(description='U-2-Net Background Removal Server'
 parser.add_argument('--host', type=str, default='0.0.0.0', help='Host to run the server on')
 parser.add_argument('--port', type=int, default=5000, help='Port to run the server on')
 parser.add_argument('--debug', action='store_true', help='Run in debug mode')
-parser.add_argument('--model', type=str, default='u2net', choices=['u2net', 'u2net_portrait'], 
+# Every model also has int8 variants created by quantize_model.py
+MODEL_CHOICES = [name + suffix for name in ('u2net', 'u2net_portrait', 'u2netp')
+                 for suffix in ('', '_int8_dynamic', '_int8_static')]
+parser.add_argument('--model', type=str, default='u2net', choices=MODEL_CHOICES,
                     help='Model to use for background removal')
-args = parser.parse_args()
+parser.add_argument('--backend', type=str, default='eager',
+                    choices=['eager', 'torchscript', 'inductor', 'onnxruntime'],
+                    help='Inference backend: eager PyTorch, cached TorchScript trace, torch.compile or ONNX Runtime')
+parser.add_argument('--ort-intra-threads', type=int, default=0,
+                    help='ONNX Runtime threads per operator (0 lets ONNX Runtime decide)')
+parser.add_argument('--ort-inter-threads', type=int, default=0,
+                    help='ONNX Runtime threads for running independent operators in parallel (0 = sequential)')
+parser.add_argument('--fuse', action='store_true',
+                    help='Fold BatchNorm and input normalization into the convolutions (parity-checked at startup)')
+parser.add_argument('--warmup', type=int, default=2,
+                    help='Warmup forward passes per batch size at startup (0 disables)')
+parser.add_argument('--batch-size', type=int, default=1,
+                    help='Maximum inference batch size; values above 1 enable micro-batching')
+parser.add_argument('--batch-wait-ms', type=float, default=5.0,
+                    help='How long to wait for more requests before running a partial batch')
+parser.add_argument('--cache-size-mb', type=float, default=256,
+                    help='In-memory result cache size in MB (0 disables the cache)')
+parser.add_argument('--cache-dir', type=str, default=None,
+                    help='Directory for the optional on-disk result cache tier')
+parser.add_argument('--cache-disk-mb', type=float, default=1024,
+                    help='Size cap for the on-disk result cache tier in MB')
+parser.add_argument('--mask-store-mb', type=float, default=512,
+                    help='Memory cap in MB for stored originals/masks behind mask handles (0 disables)')
+parser.add_argument('--mask-ttl', type=float, default=600,
+                    help='Seconds a mask handle stays valid after its last use')
+parser.add_argument('--mask-store-dir', type=str, default=None,
+                    help='Directory shared by worker processes for mask handles (defaults to /dev/shm with --workers > 1)')
+parser.add_argument('--max-upload-mb', type=float, default=50,
+                    help='Largest accepted image upload in MB (0 for no limit)')
+parser.add_argument('--max-archive-mb', type=float, default=1024,
+                    help='Largest accepted /remove-background/archive upload in MB (0 for no limit)')
+parser.add_argument('--max-megapixels', type=float, default=50,
+                    help='Largest image processed at full size; bigger uploads are shrunk on decode (0 for no limit)')
+parser.add_argument('--no-downscale', action='store_true',
+                    help='Reject images over --max-megapixels instead of shrinking them')
+parser.add_argument('--memory-budget-mb', type=float, default=2048,
+                    help='Estimated working memory for images in flight; new requests wait above it (0 disables)')
+parser.add_argument('--intake-wait', type=float, default=10,
+                    help='Seconds a request waits for memory budget before getting a 503')
+parser.add_argument('--encode-workers', type=int, default=4,
+                    help='Threads encoding output images (per worker process, 0 encodes on the request thread)')
+parser.add_argument('--png-compress-level', type=int, default=6, choices=range(10), metavar='0-9',
+                    help='Default PNG compression level (lower is faster and larger); requests can pass level=')
+parser.add_argument('--archive-batch-size', type=int, default=8,
+                    help='Images per forward pass for /remove-background/archive')
+parser.add_argument('--job-queue-size', type=int, default=32,
+                    help='Maximum queued jobs for the asynchronous /jobs API before returning 429 (0 disables it)')
+parser.add_argument('--job-workers', type=int, default=2,
+                    help='Threads processing queued jobs (per worker process)')
+parser.add_argument('--job-ttl', type=float, default=300,
+                    help='Seconds finished job results are kept')
+parser.add_argument('--job-dir', type=str, default=None,
+                    help='Directory shared by worker processes for job status and results (defaults to /dev/shm with --workers > 1)')
+parser.add_argument('--workers', type=int, default=1,
+                    help='Number of pre-forked worker processes sharing one copy of the model weights')
+parser.add_argument('--server', type=str, default='werkzeug', choices=['werkzeug', 'gunicorn'],
+                    help='HTTP server: the Werkzeug server (development) or gunicorn (production)')
+parser.add_argument('--threads', type=int, default=8,
+                    help='Request threads per worker with --server gunicorn')
+parser.add_argument('--timeout', type=int, default=120,
+                    help='Seconds before gunicorn restarts an unresponsive worker')
+parser.add_argument('--graceful-timeout', type=int, default=30,
+                    help='Seconds workers get to finish in-flight requests on shutdown or restart (gunicorn)')
+parser.add_argument('--keepalive', type=int, default=5,
+                    help='Seconds an idle keep-alive connection stays open (gunicorn)')
+parser.add_argument('--torch-threads', type=int, default=0,
+                    help='Intra-op torch threads in each worker process, not divided between workers: '
+                         '--workers 4 --torch-threads 2 uses 8 threads in total (0 splits the torch default between the workers)')
+parser.add_argument('--enable-profiling', action='store_true',
+                    help='Enable POST /profile, which profiles the model layers on an uploaded image (eager backend only)')
+parser.add_argument('--metrics-dir', type=str, default=None,
+                    help='Directory where worker processes publish metrics for /metrics (defaults to /dev/shm with --workers > 1)')
+parser.add_argument('--rss-report-interval', type=float, default=60,
+                    help='Seconds between per-worker memory reports in the logs (0 disables)')
+# When the module is imported (benchmarks, embedding) the defaults are used
+args = parser.parse_args() if __name__ == '__main__' else parser.parse_args([])
 
 # Set production environment
 PRODUCTION = os.environ.get('FLASK_ENV', 'production') == 'production'
@@ -52,8 +135,23 @@ logger.info(f"Current working directory: {current_dir}")
 
 try:
     # Import from local copies in python_backend
-    from model import U2NET
+    from model import U2NET, U2NETP
+    from model.fusion import fuse_model, fusion_parity
+    from model.profiling import SORT_KEYS
     from data_loader import RescaleT, ToTensorLab
+    from inference import (CustomRescale, InputBufferPool, load_model, compile_model, warmup_model,
+                           run_model, prediction_to_numpy, upsample_mask)
+    from compositing import compose_cutout, composite_background, guided_upsample
+    from batching import InferenceBatcher
+    from result_cache import ResultCache, make_cache_key
+    from mask_store import MaskStore
+    from prefork import PreforkServer, process_memory, sibling_worker_pids
+    from jobs import JobQueue, QueueFullError, FAILED
+    from image_source import ImageSource
+    from metrics import MetricsRegistry
+    from encoding import ImageEncoder, encode_options, encode_image
+    from intake import ImageIntake, IntakeError, IntakeBusyError, UploadTooLargeError
+    from archive_io import spool_stream, iter_archive_members, unique_output_name, TarStreamWriter
     logger.info("Successfully imported U-2-Net modules")
 except ImportError as e:
     logger.error(f"Error importing U-2-Net modules: {e}")
@@ -61,130 +159,199 @@ except ImportError as e:
     logger.error("pip install torch torchvision matplotlib scikit-image")
     sys.exit(1)
 
-# Custom transform function that doesn't rely on the U-2-Net data_loader
-class CustomRescale:
-    def __init__(self, output_size):
-        self.output_size = output_size
-        
-    def __call__(self, image):
-        # Convert PIL image to numpy array
-        img = np.array(image)
-        
-        # Resize to output_size
-        img = Image.fromarray(img).resize((self.output_size, self.output_size), Image.BILINEAR)
-        img = np.array(img)
-        
-        # Normalize to [0,1]
-        img = img.astype(np.float32) / 255.0
-        
-        # Add normalization as in ToTensorLab
-        if img.shape[2] == 3:  # RGB
-            tmp_img = np.zeros((img.shape[0], img.shape[1], 3))
-            tmp_img[:,:,0] = (img[:,:,0] - 0.485) / 0.229
-            tmp_img[:,:,1] = (img[:,:,1] - 0.456) / 0.224
-            tmp_img[:,:,2] = (img[:,:,2] - 0.406) / 0.225
-        else:  # Grayscale or other
-            tmp_img = np.zeros((img.shape[0], img.shape[1], 3))
-            tmp_img[:,:,0] = (img[:,:,0] - 0.485) / 0.229
-            tmp_img[:,:,1] = (img[:,:,0] - 0.485) / 0.229
-            tmp_img[:,:,2] = (img[:,:,0] - 0.485) / 0.229
-            
-        # Convert to tensor format (channel first)
-        tmp_img = tmp_img.transpose((2, 0, 1))
-        
-        # Convert to torch tensor
-        tensor = torch.from_numpy(tmp_img).float()
-        
-        return tensor
+# The model, loaded by create_app
+net = None
 
-def load_model(model_name='u2net'):
-    model_dir = os.path.join(current_dir, 'saved_models', model_name, model_name + '.pth')
-    
-    logger.info(f"Loading {model_name} from {model_dir}")
-    
-    # Check if model exists
-    if not os.path.exists(model_dir):
-        logger.error(f"ERROR: Model file not found at {model_dir}")
-        return None
-    
-    # Create model
-    net = U2NET(3, 1)
-    
-    try:
-        if torch.cuda.is_available():
-            net.load_state_dict(torch.load(model_dir))
-            net.cuda()
-            net.eval()
-            logger.info("Model loaded on CUDA")
-        else:
-            net.load_state_dict(torch.load(model_dir, map_location='cpu'))
-            net.eval()
-            logger.info("Model loaded on CPU")
-        
-        return net
-    except Exception as e:
-        logger.error(f"Error loading model: {e}")
-        return None
+# Micro-batching scheduler, started by start_services when --batch-size > 1
+batcher = None
+
+# Index of this worker process when running with --workers > 1 or gunicorn
+worker_id = None
+
+# Torch threads before the parent drops to one thread for forking
+default_torch_threads = torch.get_num_threads()
+
+# True when the model has normalization folded in and takes 0-255 input (--fuse)
+raw_input = False
 
-def norm_pred(d):
-    ma = torch.max(d)
-    mi = torch.min(d)
-    dn = (d-mi)/(ma-mi)
-    return dn
+# Preallocated model inputs, reused across requests
+input_buffers = InputBufferPool(320)
 
-def process_image(net, image):
+# Prometheus metrics served at /metrics
+metrics = MetricsRegistry()
+STAGE_SECONDS = metrics.histogram('u2net_stage_seconds', 'Time spent in each processing stage', ['stage'])
+REQUESTS = metrics.counter('u2net_requests_total', 'Requests handled, by endpoint and status', ['endpoint', 'status'])
+REQUEST_ERRORS = metrics.counter('u2net_request_errors_total', 'Requests answered with a 5xx status', ['endpoint'])
+REQUEST_SECONDS = metrics.histogram('u2net_request_seconds', 'Time until the response starts', ['endpoint'])
+REQUESTS_IN_FLIGHT = metrics.gauge('u2net_requests_in_flight', 'Requests being handled')
+INPUT_MEGAPIXELS = metrics.histogram('u2net_input_megapixels', 'Size of uploaded images in megapixels',
+                                     buckets=(0.1, 0.3, 1, 2, 4, 8, 12, 16, 24, 36, 50, 100))
+metrics.gauge('u2net_batch_queue_depth', 'Inputs waiting for a micro-batch',
+              function=lambda: batcher.pending() if batcher is not None else None)
+metrics.gauge('u2net_job_queue_depth', 'Jobs waiting in the /jobs queue',
+              function=lambda: job_queue.stats()['queued'] if job_queue is not None else None)
+metrics.gauge('u2net_intake_in_flight_bytes', 'Estimated working memory reserved by requests in flight',
+              function=lambda: intake.stats()['in_flight_bytes'] if intake is not None else None)
+metrics.gauge('process_resident_memory_bytes', 'Resident memory of this process',
+              function=lambda: process_memory(os.getpid())['rss'])
+
+def timed(stage):
+    """Context manager recording the duration of a processing stage"""
+    return STAGE_SECONDS.time(stage=stage)
+
+def predict_mask(net, tensor):
+    """Predict a normalized 320x320 mask for a single (3, 320, 320) tensor"""
+    if batcher is not None:
+        pred = batcher.predict(tensor)
+    else:
+        pred = run_model(net, tensor.unsqueeze(0))[0]
+    
+    return prediction_to_numpy(pred)
+
+def predict_source(net, source):
+    """Run the model on an ImageSource and return its normalized 320x320 prediction"""
     if net is None:
         raise ValueError("Model not loaded properly")
     
-    logger.info(f"Processing image: {image.size}x{image.mode}")
-    
-    # Convert image to RGB if not already
-    if image.mode != 'RGB':
-        image = image.convert('RGB')
+    logger.info(f"Processing image: {source.size[0]}x{source.size[1]}")
     
-    # Apply custom transforms (resize and normalize)
-    transform = CustomRescale(320)
-    tensor = transform(image).unsqueeze(0)  # Add batch dimension
-    
-    # Move to GPU if available
-    if torch.cuda.is_available():
-        tensor = tensor.cuda()
+    # Resize and normalize a reduced-resolution decode straight into a pooled
+    # input buffer, then run the forward pass (shared with other requests when
+    # batching is enabled)
+    transform = CustomRescale(320, normalize=not raw_input)
+    inputs = input_buffers.acquire(1)
+    try:
+        with timed('decode'):
+            image = source.inference_image(320)
+        with timed('preprocess'):
+            transform(image, out=inputs[0])
+        with timed('inference'):
+            return predict_mask(net, inputs[0])
+    finally:
+        input_buffers.release(inputs)
+
+def compute_mask(net, image):
+    """Run the model on an image (PIL image or ImageSource) and return (RGB image, full-resolution L mask)"""
+    source = ImageSource.wrap(image)
+    predict_np = predict_source(net, source)
     
-    # Create variable for model
-    inputs_test = Variable(tensor)
+    # Create mask image
+    with timed('mask'):
+        mask = upsample_mask(predict_np, source.size)
     
-    # Forward pass
-    with torch.no_grad():
-        d1, d2, d3, d4, d5, d6, d7 = net(inputs_test)
+    # The full-resolution decode only happens now, for compositing
+    with timed('decode'):
+        return source.full_image(), mask
+
+def compute_mask_only(net, image, size, refine=None):
+    """Predict the L mask of an image (PIL image or ImageSource) at the given (width, height).
     
-    # Normalize prediction
-    pred = d1[:, 0, :, :]
-    pred = norm_pred(pred)
+    Nothing is composited, and the full-resolution image is only decoded when
+    the mask is refined against it.
+    """
+    source = ImageSource.wrap(image)
+    predict_np = predict_source(net, source)
     
-    # Convert to numpy
-    predict = pred.squeeze()
-    predict_np = predict.cpu().data.numpy()
+    if refine == 'guided':
+        with timed('decode'):
+            image = source.full_image()
+        with timed('mask'):
+            mask = guided_upsample(image, upsample_mask(predict_np, source.size))
+            return mask if mask.size == size else mask.resize(size, Image.BILINEAR)
+    with timed('mask'):
+        return upsample_mask(predict_np, size)
+
+def compute_masks(net, images):
+    """Batched compute_mask: one forward pass for a list of images or ImageSources.
     
-    # Create mask image
-    mask = Image.fromarray((predict_np * 255).astype(np.uint8))
-    mask = mask.resize((image.width, image.height), Image.BILINEAR)
+    Returns (ImageSource, full-resolution L mask) pairs; call full_image() on
+    each source when compositing, so full-size decodes are not done up front.
+    """
+    if net is None:
+        raise ValueError("Model not loaded properly")
     
-    # Create transparent result image
-    result = Image.new('RGBA', (image.width, image.height), (0, 0, 0, 0))
+    sources = [ImageSource.wrap(image) for image in images]
+    transform = CustomRescale(320, normalize=not raw_input)
+    inputs = input_buffers.acquire(len(sources))
+    try:
+        for i, source in enumerate(sources):
+            with timed('decode'):
+                image = source.inference_image(320)
+            with timed('preprocess'):
+                transform(image, out=inputs[i])
+        with timed('inference'):
+            preds = run_model(net, inputs)
+    finally:
+        input_buffers.release(inputs)
     
-    # Convert original to RGBA
-    image = image.convert('RGBA')
+    results = []
+    for source, pred in zip(sources, preds):
+        with timed('mask'):
+            results.append((source, upsample_mask(prediction_to_numpy(pred), source.size)))
+    return results
+
+def process_image(net, image, soft_alpha=False, refine=None):
+    image, mask = compute_mask(net, image)
     
-    # Apply the mask
-    mask_np = np.array(mask)
-    for y in range(image.height):
-        for x in range(image.width):
-            r, g, b, a = image.getpixel((x, y))
-            if mask_np[y, x] > 100:  # Threshold
-                result.putpixel((x, y), (r, g, b, 255))
+    # Apply the mask (vectorized, see compositing.py)
+    result = compose_mask(image, mask, soft=soft_alpha, refine=refine)
     
     return result
 
+# Mask refinements selectable per request ('guided' = edge-aware guided filter upsampling)
+MASK_REFINEMENTS = ('none', 'guided')
+
+def compose_mask(image, mask, soft=False, refine=None):
+    """Cut out the foreground, optionally refining the mask against the full-resolution image first"""
+    if refine == 'guided':
+        # The guided filter produces a soft matte, so it is used as alpha directly
+        return compose_cutout(image, guided_upsample(image, mask), soft=True)
+    return compose_cutout(image, mask, soft=soft)
+
+# What the remove-background endpoints return: the composited cutout or just the mask
+OUTPUT_MODES = ('cutout', 'mask')
+
+def requested_output(value):
+    """Validate an 'output' request value, returning True for mask-only responses"""
+    if value is not None and not isinstance(value, str):
+        raise ValueError(f"Unsupported output: {value}")
+    output = (value or 'cutout').lower()
+    if output not in OUTPUT_MODES:
+        raise ValueError(f"Unsupported output: {value}")
+    return output == 'mask'
+
+def requested_mask_size(value, image_size):
+    """Resolve a 'maskSize' request value to (width, height).
+    
+    'full' (the default) is the image size, 'model' the raw 320x320 prediction,
+    anything else must be WIDTHxHEIGHT.
+    """
+    if value is not None and not isinstance(value, str):
+        raise ValueError(f"Unsupported mask size: {value}")
+    value = (value or 'full').lower()
+    if value == 'full':
+        return tuple(image_size)
+    if value == 'model':
+        return (320, 320)
+    try:
+        width, height = (int(part) for part in value.split('x'))
+    except ValueError:
+        raise ValueError(f"Unsupported mask size: {value}")
+    if width <= 0 or height <= 0:
+        raise ValueError(f"Unsupported mask size: {value}")
+    if intake is not None and intake.max_pixels and width * height > intake.max_pixels:
+        raise UploadTooLargeError(f"Mask size {width}x{height} is over the {intake.max_pixels} pixel limit")
+    return width, height
+
+def requested_refinement(value):
+    """Validate a 'refine' request value, returning None for no refinement"""
+    if value is not None and not isinstance(value, str):
+        raise ValueError(f"Unsupported mask refinement: {value}")
+    refine = (value or 'none').lower()
+    if refine not in MASK_REFINEMENTS:
+        raise ValueError(f"Unsupported mask refinement: {value}")
+    return None if refine == 'none' else refine
+
 # Dictionary of background preset colors
 BACKGROUND_PRESETS = {
     'white': (255, 255, 255, 255),
@@ -194,11 +361,24 @@ BACKGROUND_PRESETS = {
 # Get the directory paths
 current_dir = os.path.dirname(os.path.abspath(__file__))
 
-def apply_background(image, background_type):
-    """Apply a background to a transparent image"""
+def apply_background(image, background_type, mask=None, refine=None):
+    """Apply a background to a transparent image, or to an original image plus its mask"""
+    if mask is not None:
+        # Stored originals are composited straight from the mask
+        if background_type == 'transparent':
+            return compose_mask(image, mask, refine=refine)
+        color = BACKGROUND_PRESETS.get(background_type, (255, 255, 255, 255))
+        if refine == 'guided':
+            return composite_background(image, guided_upsample(image, mask), color, soft=True)
+        return composite_background(image, mask, color)
+    
     if background_type == 'transparent':
         return image
     
+    # Paste needs an alpha channel to use as the mask
+    if image.mode != 'RGBA':
+        image = image.convert('RGBA')
+    
     # Get image dimensions
     width, height = image.size
     
@@ -216,16 +396,299 @@ def apply_background(image, background_type):
     
     return composite
 
+# Chunk size used when streaming encoded images back to the client
+STREAM_CHUNK_SIZE = 64 * 1024
+
+def binary_upload_stream():
+    """Return the uploaded image stream from a multipart 'image' field or the raw request body"""
+    if 'image' in request.files:
+        return request.files['image'].stream
+    return request.stream
+
+# Upload budgets and in-flight memory tracking, created by start_services
+intake = None
+
+def read_upload():
+    """Read the raw/multipart upload, refusing bodies over the byte budget"""
+    try:
+        stream = binary_upload_stream()
+        return intake.read(stream) if intake is not None else stream.read()
+    except RequestEntityTooLarge:
+        raise UploadTooLargeError("Request body is too large for the upload limit")
+
+def check_json_upload_size():
+    """Reject JSON bodies too large to hold an image within the byte budget (base64 adds a third)"""
+    if intake is not None and intake.max_bytes and request.content_length is not None:
+        if request.content_length > intake.max_bytes * 4 // 3 + STREAM_CHUNK_SIZE:
+            raise UploadTooLargeError(f"Request body is {request.content_length} bytes, too large for the upload limit")
+    try:
+        # Chunked bodies have no Content-Length; reading them stops at the request's body limit
+        data = request.get_data(cache=True)
+    except RequestEntityTooLarge:
+        raise UploadTooLargeError("Request body is too large for the upload limit")
+    limit = request.max_content_length
+    if request.content_length is None and limit is not None and len(data) >= limit:
+        raise UploadTooLargeError("Request body is too large for the upload limit")
+
+def body_limit(endpoint):
+    """Largest request body in bytes an endpoint accepts (None for no limit)"""
+    if endpoint == 'remove_background_archive':
+        return int(args.max_archive_mb * 1024 * 1024) or None
+    if not args.max_upload_mb:
+        return None
+    # base64 JSON bodies are a third larger than the image, plus room for the other fields
+    return int(args.max_upload_mb * 1024 * 1024) * 4 // 3 + STREAM_CHUNK_SIZE
+
+def open_upload(image_bytes):
+    """Check an upload against the intake budgets and return its ImageSource"""
+    with timed('open'):
+        source = intake.open(image_bytes) if intake is not None else ImageSource(image_bytes)
+    width, height = source.source_size
+    INPUT_MEGAPIXELS.observe(width * height / 1e6)
+    return source
+
+def memory_reservation(sources):
+    """Hold the estimated working memory of one or more ImageSources (or PIL images) while processing them"""
+    if intake is None:
+        return contextlib.nullcontext()
+    return intake.reserve(intake.estimate(sources))
+
+def intake_error_response(error):
+    """JSON error response for uploads the intake refused or deferred"""
+    response = jsonify({'success': False, 'error': str(error)})
+    if isinstance(error, IntakeBusyError):
+        response.headers['Retry-After'] = '1'
+    return response, error.status
+
+def read_binary_image():
+    """Open the uploaded image from a multipart 'image' field or the raw request body as an ImageSource"""
+    return open_upload(read_upload())
+
+# Output encoding thread pool, created by start_services unless --encode-workers is 0
+encoder = None
+
+def requested_encoding(params, mask=False):
+    """EncodeOptions from the format/quality/lossless/level request parameters; raises ValueError"""
+    options = encode_options(params.get('format', 'png'), quality=params.get('quality'),
+                             lossless=params.get('lossless'), compress_level=params.get('level'),
+                             default_level=args.png_compress_level)
+    if options.format == 'raw' and not mask:
+        raise ValueError("Raw output is only available with output=mask")
+    return options
+
+# Endpoints whose JSON responses carry encoded images; response compression skips them
+PRECOMPRESSED_ENDPOINTS = {'remove_background', 'customize_product', 'job_result'}
+
+def encode_result(image, options):
+    """Encode an image on the encoder pool (or inline without one), returning (bytes, mimetype)"""
+    with timed('encode'):
+        if encoder is None:
+            return encode_image(image, options)
+        return encoder.encode(image, options)
+
+def stream_bytes_response(data, mimetype):
+    """Send encoded image bytes (or a buffer view) back as a chunked binary response body"""
+    data = memoryview(data)
+    size = data.nbytes
+    
+    def generate():
+        try:
+            for start in range(0, size, STREAM_CHUNK_SIZE):
+                yield bytes(data[start:start + STREAM_CHUNK_SIZE])
+        finally:
+            data.release()
+    
+    return Response(generate(), mimetype=mimetype, headers={'Content-Length': str(size)})
+
+def stream_image_response(image, options):
+    """Encode an image and send it back as a chunked binary response body"""
+    encoded, mimetype = encode_result(image, options)
+    return stream_bytes_response(encoded, mimetype)
+
+# Result cache, created by start_services unless --cache-size-mb is 0
+result_cache = None
+
+def result_cache_key(image_bytes, **params):
+    """Cache key for an upload, or None when caching is disabled"""
+    if result_cache is None:
+        return None
+    return make_cache_key(image_bytes, args.model, **params)
+
+# Store of originals and masks behind the handles returned by /remove-background,
+# created by start_services unless --mask-store-mb is 0
+mask_store = None
+
+def mask_handle_for(image_bytes):
+    """Content-addressed mask handle for an upload, or None when the store is disabled"""
+    if mask_store is None:
+        return None
+    return make_cache_key(image_bytes, args.model, kind='mask')
+
+def run_background_removal(image_bytes=None, image=None, options=None, refine=None, mask_size=None):
+    """Remove the background from uploaded bytes (or an already opened image or ImageSource).
+
+    Returns (encoded bytes, mimetype, mask handle). The result cache is only
+    trusted when the matching mask handle is still stored, otherwise the
+    model runs again so the handle can be re-registered. With a mask_size,
+    only the mask is returned, at that (width, height), and no handle is made.
+    """
+    options = options or encode_options(default_level=args.png_compress_level)
+    mimetype = options.mimetype
+    handle = mask_handle_for(image_bytes) if image_bytes is not None and mask_size is None else None
+    cache_key = result_cache_key(image_bytes, encoding=options, soft_alpha=False, refine=refine,
+                                 mask_size=mask_size) if image_bytes is not None else None
+    
+    # Check the result cache before running the model
+    if cache_key and (handle is None or mask_store.touch(handle)):
+        cached = result_cache.get(cache_key)
+        if cached is not None:
+            logger.info("Serving background removal result from cache")
+            return cached, mimetype, handle
+    
+    image = open_upload(image_bytes) if image is None else ImageSource.wrap(image)
+    
+    if mask_size is not None:
+        # Mask only: the full-resolution image is decoded (and budgeted) only for refinement
+        logger.info("Computing mask...")
+        with memory_reservation(image) if refine else contextlib.nullcontext():
+            mask = compute_mask_only(net, image, mask_size, refine)
+            encoded, mimetype = encode_result(mask, options)
+    else:
+        # Process the image, waiting for room in the memory budget first
+        logger.info("Processing image for background removal...")
+        with memory_reservation(image):
+            image, mask = compute_mask(net, image)
+            with timed('compose'):
+                result = compose_mask(image, mask, refine=refine)
+            
+            encoded, mimetype = encode_result(result, options)
+            del result
+    
+    if cache_key:
+        result_cache.put(cache_key, encoded)
+    if handle and not mask_store.put(handle, image, mask):
+        handle = None
+    
+    return encoded, mimetype, handle
+
+@app.before_request
+def start_request_metrics():
+    g.request_start = time.perf_counter()
+    REQUESTS_IN_FLIGHT.inc()
+
+@app.before_request
+def limit_request_body():
+    # Flask 3.1+ lets each request lower the app-wide MAX_CONTENT_LENGTH to its endpoint's limit
+    try:
+        request.max_content_length = body_limit(request.endpoint)
+    except AttributeError:
+        pass
+
+@app.errorhandler(RequestEntityTooLarge)
+def request_too_large(error):
+    return jsonify({'success': False, 'error': 'Request body is too large for the upload limit'}), 413
+
+@app.after_request
+def record_request_metrics(response):
+    endpoint = request.endpoint or 'unmatched'
+    REQUESTS.inc(endpoint=endpoint, status=response.status_code)
+    if response.status_code >= 500:
+        REQUEST_ERRORS.inc(endpoint=endpoint)
+    REQUEST_SECONDS.observe(time.perf_counter() - g.request_start, endpoint=endpoint)
+    return response
+
+@app.teardown_request
+def finish_request_metrics(exc):
+    # Runs once streamed responses have been sent
+    REQUESTS_IN_FLIGHT.dec()
+
 # Add the required endpoints
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    """Stage latencies, request counters, queue depths and memory in Prometheus text format"""
+    text = metrics.render(args.metrics_dir, worker_id)
+    return Response(text, content_type='text/plain; version=0.0.4; charset=utf-8')
+
 @app.route('/health', methods=['GET'])
 def health_check():
     """Health check endpoint to verify server status"""
     return jsonify({
         'status': 'healthy',
         'timestamp': time.time(),
-        'model_loaded': net is not None if 'net' in globals() else False
+        'model_loaded': net is not None,
+        'backend': args.backend,
+        'fused': raw_input,
+        'batching': batcher.stats() if batcher is not None else None,
+        'cache': result_cache.stats() if result_cache is not None else None,
+        'mask_store': mask_store.stats() if mask_store is not None else None,
+        'jobs': job_queue.stats() if job_queue is not None else None,
+        'intake': intake.stats() if intake is not None else None,
+        'worker': {'index': worker_id, **process_memory(os.getpid())}
     })
 
+@app.route('/workers', methods=['GET'])
+def workers_info():
+    """Per-worker memory usage (RSS, PSS and shared pages, in bytes)"""
+    if worker_id is None:
+        return jsonify({'workers': [process_memory(os.getpid())]})
+    return jsonify({
+        'parent': process_memory(os.getppid()),
+        'workers': [process_memory(pid) for pid in sibling_worker_pids()]
+    })
+
+# One profile at a time, so concurrent profiles don't skew each other's timings
+profile_lock = threading.Lock()
+
+PROFILE_FORMATS = ('json', 'table', 'trace')
+
+@app.route('/profile', methods=['POST'])
+def profile_model():
+    """Profile the model layers on a raw/multipart image upload (JSON summary, text table or Chrome trace)"""
+    if not args.enable_profiling:
+        return jsonify({'success': False, 'error': 'Profiling is disabled (start the server with --enable-profiling)'}), 404
+    if not isinstance(net, (U2NET, U2NETP)):
+        return jsonify({'success': False, 'error': 'Profiling needs the eager backend'}), 400
+    
+    try:
+        output_format = request.args.get('format', 'json').lower()
+        sort = request.args.get('sort')
+        try:
+            depth = int(request.args.get('depth', 1))
+        except ValueError:
+            depth = 0
+        if output_format not in PROFILE_FORMATS or (sort and sort not in SORT_KEYS) or depth < 1:
+            return jsonify({'success': False, 'error': 'Use format=json|table|trace, sort=time|flops|memory, depth>=1'}), 400
+        
+        try:
+            source = open_upload(read_upload())
+        except UnidentifiedImageError:
+            return jsonify({'success': False, 'error': 'No valid image provided'}), 400
+        inputs = CustomRescale(320, normalize=not raw_input)(source.inference_image(320)).unsqueeze(0)
+        
+        # Hooks only record this thread, so other requests keep using the model meanwhile
+        with profile_lock, net.profile(depth) as profiler:
+            run_model(net, inputs)
+        
+        if output_format == 'table':
+            return Response(profiler.table(sort=sort) + '\n', mimetype='text/plain')
+        if output_format == 'trace':
+            return jsonify(profiler.chrome_trace())
+        return jsonify({'success': True, 'totalMs': round(profiler.elapsed * 1000, 2),
+                        'modules': profiler.summary(sort)})
+    
+    except IntakeError as e:
+        return intake_error_response(e)
+    except Exception as e:
+        logger.error(f"Error profiling model: {str(e)}")
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@app.route('/cache/stats', methods=['GET'])
+def cache_stats():
+    """Result cache hit/miss/eviction counters"""
+    if result_cache is None:
+        return jsonify({'enabled': False})
+    return jsonify({'enabled': True, **result_cache.stats()})
+
 @app.route('/', methods=['GET'])
 def index():
     """Root endpoint with API information"""
@@ -236,8 +699,18 @@ def index():
         'endpoints': {
             '/': 'This API information',
             '/health': 'Health check endpoint',
+            '/metrics': 'Prometheus metrics',
+            '/profile': 'Per-layer time, FLOPs and output size of the model on an uploaded image (POST, --enable-profiling)',
+            '/cache/stats': 'Result cache counters',
+            '/workers': 'Per-worker memory usage',
+            '/remove-background/archive': 'Remove backgrounds from a zip/tar of images, streams back a tar of cutouts (POST)',
+            '/jobs': 'Queue an asynchronous background removal job (POST)',
+            '/jobs/<id>': 'Job status and queue position',
+            '/jobs/<id>/result': 'Fetch a finished job result',
             '/remove-background': 'Remove background from an image (POST)',
-            '/customize-product': 'Apply customizations to an image (POST)'
+            '/customize-product': 'Apply customizations to an image (POST)',
+            '/remove-background/binary': 'Remove background from a raw or multipart image upload, returns image bytes (POST)',
+            '/customize-product/binary': 'Apply customizations to a raw or multipart image upload, returns image bytes (POST)'
         },
         'status': 'running'
     })
@@ -248,6 +721,7 @@ def remove_background():
     if request.method == 'POST':
         try:
             # Get the image from the request
+            check_json_upload_size()
             data = request.json
             if not data or 'image' not in data:
                 return jsonify({'success': False, 'error': 'No image provided'}), 400
@@ -259,28 +733,53 @@ def remove_background():
                 image_data = image_data.split(',')[1]
             
             # Decode the base64 string
-            image_bytes = base64.b64decode(image_data)
-            
-            # Open the image
-            image = Image.open(io.BytesIO(image_bytes))
+            with timed('base64_decode'):
+                image_bytes = base64.b64decode(image_data)
             
-            # Process the image
-            logger.info("Processing image for background removal...")
-            result = process_image(net, image)
+            try:
+                refine = requested_refinement(data.get('refine'))
+                mask_only = requested_output(data.get('output'))
+                options = requested_encoding(data, mask=mask_only)
+                
+                # Mask sizes are resolved against the image size from the header
+                image, mask_size = None, None
+                if mask_only:
+                    image = open_upload(image_bytes)
+                    mask_size = requested_mask_size(data.get('maskSize'), image.size)
+            except ValueError as e:
+                return jsonify({'success': False, 'error': str(e)}), 400
             
-            # Save the result to a buffer
-            buffer = io.BytesIO()
-            result.save(buffer, format="PNG")
-            buffer.seek(0)
+            # Process the image (or fetch it from the result cache)
+            try:
+                encoded, mimetype, handle = run_background_removal(image_bytes, image, options, refine, mask_size)
+            except ValueError as e:
+                return jsonify({'success': False, 'error': str(e)}), 400
             
             # Encode the buffer as base64
-            img_str = base64.b64encode(buffer.getvalue()).decode('utf-8')
+            with timed('base64_encode'):
+                img_str = base64.b64encode(encoded).decode('utf-8')
             
-            return jsonify({
+            if mask_only:
+                return jsonify({
+                    'success': True,
+                    'maskUrl': f"data:{mimetype};base64,{img_str}",
+                    'width': mask_size[0],
+                    'height': mask_size[1]
+                })
+            
+            response = {
                 'success': True,
-                'processedImageUrl': f"data:image/png;base64,{img_str}"
-            })
+                'processedImageUrl': f"data:{mimetype};base64,{img_str}"
+            }
+            if handle:
+                # Lets /customize-product recomposite without re-uploading the image
+                response['maskHandle'] = handle
+                response['maskHandleTtl'] = mask_store.ttl
             
+            return jsonify(response)
+            
+        except IntakeError as e:
+            return intake_error_response(e)
         except Exception as e:
             logger.error(f"Error removing background: {str(e)}")
             return jsonify({'success': False, 'error': str(e)}), 500
@@ -291,8 +790,9 @@ def customize_product():
     if request.method == 'POST':
         try:
             # Get the image and background type from the request
+            check_json_upload_size()
             data = request.json
-            if not data or 'image' not in data:
+            if not data or ('image' not in data and 'maskHandle' not in data):
                 return jsonify({'success': False, 'error': 'No image provided'}), 400
             
             # Get background type (default to transparent)
@@ -310,53 +810,628 @@ def customize_product():
             # Log all keys in the request for debugging
             logger.info(f"Request data keys: {list(data.keys())}")
             
-            # Decode base64 image
-            image_data = data['image']
-            if image_data.startswith('data:image'):
-                # Remove the data:image/jpeg;base64, prefix
-                image_data = image_data.split(',')[1]
-            
-            # Decode the base64 string
-            image_bytes = base64.b64decode(image_data)
-            
-            # Open the image
-            image = Image.open(io.BytesIO(image_bytes))
+            mask = None
+            if 'maskHandle' in data:
+                # Composite from the stored original and mask
+                stored = mask_store.get(data['maskHandle']) if mask_store is not None else None
+                if stored is None:
+                    return jsonify({'success': False, 'error': 'Unknown or expired mask handle'}), 404
+                image, mask = stored
+            else:
+                # Decode base64 image
+                image_data = data['image']
+                if image_data.startswith('data:image'):
+                    # Remove the data:image/jpeg;base64, prefix
+                    image_data = image_data.split(',')[1]
+                
+                # Decode the base64 string
+                with timed('base64_decode'):
+                    image_bytes = base64.b64decode(image_data)
+                
+                # Open the image (within the intake budgets); it is decoded once memory is reserved
+                image = open_upload(image_bytes)
             
             # Apply background
-            logger.info(f"Applying {background_type} background...")
-            result = apply_background(image, background_type)
+            try:
+                refine = requested_refinement(data.get('refine'))
+                options = requested_encoding(data)
+            except ValueError as e:
+                return jsonify({'success': False, 'error': str(e)}), 400
             
-            # Save the result to a buffer
-            buffer = io.BytesIO()
-            result.save(buffer, format="PNG")
-            buffer.seek(0)
+            logger.info(f"Applying {background_type} background...")
+            with memory_reservation(image):
+                image = ImageSource.wrap(image).full_image()
+                with timed('compose'):
+                    result = apply_background(image, background_type, mask, refine)
+                
+                # Encode the result
+                try:
+                    encoded, mimetype = encode_result(result, options)
+                except ValueError as e:
+                    return jsonify({'success': False, 'error': str(e)}), 400
+                del result
             
             # Encode the buffer as base64
-            img_str = base64.b64encode(buffer.getvalue()).decode('utf-8')
+            with timed('base64_encode'):
+                img_str = base64.b64encode(encoded).decode('utf-8')
             
             return jsonify({
                 'success': True,
-                'processedImageUrl': f"data:image/png;base64,{img_str}",
+                'processedImageUrl': f"data:{mimetype};base64,{img_str}",
                 'backgroundType': background_type
             })
             
+        except IntakeError as e:
+            return intake_error_response(e)
         except Exception as e:
             logger.error(f"Error customizing product: {str(e)}")
             return jsonify({'success': False, 'error': str(e)}), 500
 
-if __name__ == '__main__':
+@app.route('/remove-background/binary', methods=['POST'])
+def remove_background_binary():
+    """Remove background from a raw/multipart upload and return the image bytes"""
+    try:
+        try:
+            mask_only = requested_output(request.args.get('output'))
+            options = requested_encoding(request.args, mask=mask_only)
+            refine = requested_refinement(request.args.get('refine'))
+        except ValueError as e:
+            return jsonify({'success': False, 'error': str(e)}), 400
+        
+        # PIL buffers non-seekable uploads anyway, so read the bytes once: they are
+        # needed for hashing and let JPEGs be decoded at reduced size for inference
+        image_bytes = read_upload()
+        try:
+            image = open_upload(image_bytes)
+        except UnidentifiedImageError:
+            return jsonify({'success': False, 'error': 'No valid image provided'}), 400
+        
+        logger.info("Processing binary image for background removal...")
+        try:
+            mask_size = requested_mask_size(request.args.get('maskSize'), image.size) if mask_only else None
+            encoded, mimetype, handle = run_background_removal(image_bytes, image, options, refine, mask_size)
+        except ValueError as e:
+            return jsonify({'success': False, 'error': str(e)}), 400
+        
+        response = stream_bytes_response(encoded, mimetype)
+        if handle:
+            response.headers['X-Mask-Handle'] = handle
+        if mask_size:
+            response.headers['X-Mask-Width'], response.headers['X-Mask-Height'] = map(str, mask_size)
+        return response
+    
+    except IntakeError as e:
+        return intake_error_response(e)
+    except Exception as e:
+        logger.error(f"Error removing background: {str(e)}")
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@app.route('/customize-product/binary', methods=['POST'])
+def customize_product_binary():
+    """Apply a background to a raw/multipart upload and return the image bytes"""
+    try:
+        background_type = request.args.get('background') or request.form.get('background') or 'transparent'
+        try:
+            options = requested_encoding(request.values)
+            refine = requested_refinement(request.args.get('refine') or request.form.get('refine'))
+        except ValueError as e:
+            return jsonify({'success': False, 'error': str(e)}), 400
+        
+        mask = None
+        handle = request.args.get('handle') or request.form.get('handle')
+        if handle:
+            # Composite from the stored original and mask, no upload needed
+            stored = mask_store.get(handle) if mask_store is not None else None
+            if stored is None:
+                return jsonify({'success': False, 'error': 'Unknown or expired mask handle'}), 404
+            image, mask = stored
+        else:
+            try:
+                image = read_binary_image()
+            except UnidentifiedImageError:
+                return jsonify({'success': False, 'error': 'No valid image provided'}), 400
+        
+        logger.info(f"Applying {background_type} background to binary image...")
+        with memory_reservation(image):
+            image = ImageSource.wrap(image).full_image()
+            with timed('compose'):
+                result = apply_background(image, background_type, mask, refine)
+            
+            try:
+                return stream_image_response(result, options)
+            except ValueError as e:
+                return jsonify({'success': False, 'error': str(e)}), 400
+    
+    except IntakeError as e:
+        return intake_error_response(e)
+    except Exception as e:
+        logger.error(f"Error customizing product: {str(e)}")
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+def archive_result_stream(archive_file, batch_size, include_manifest, options):
+    """Generator yielding a tar of cutouts (PNG by default) for every image in an uploaded archive.
+    
+    Images are decoded, run through the model and encoded one batch at a time,
+    so memory stays flat regardless of archive size.
+    """
+    writer = TarStreamWriter()
+    manifest = []
+    output_names = set()
+    members = iter_archive_members(archive_file, max_bytes=intake.max_bytes if intake is not None else 0)
+    
+    def process_batch(batch):
+        # batch holds (entry, image) pairs whose headers passed the intake checks;
+        # nothing is decoded until their memory is reserved
+        try:
+            with memory_reservation([image for _, image in batch]):
+                run_batch(decode_batch(batch))
+        except IntakeError as e:
+            for entry, _ in batch:
+                entry['error'] = str(e)
+    
+    def decode_batch(batch):
+        # Decode only what inference needs; the full image is decoded when composited
+        decoded = []
+        for entry, image in batch:
+            start = time.perf_counter()
+            try:
+                with timed('decode'):
+                    image.inference_image(320)
+                decoded.append((entry, image))
+            except Exception as e:
+                entry['error'] = f"Could not decode image: {e}"
+            finally:
+                entry['decodeMs'] = round(entry['decodeMs'] + (time.perf_counter() - start) * 1000, 2)
+        return decoded
+    
+    def run_batch(batch):
+        if not batch:
+            return
+        start = time.perf_counter()
+        try:
+            results = compute_masks(net, [image for _, image in batch])
+        except Exception as e:
+            logger.error(f"Archive batch failed: {e}")
+            for entry, _ in batch:
+                entry['error'] = str(e)
+            return
+        inference_ms = (time.perf_counter() - start) * 1000 / len(batch)
+        
+        # Compose each cutout and hand it to the encoder pool, so encoding overlaps
+        # with composing the rest of the batch
+        pending = []
+        for (entry, _), (source, mask) in zip(batch, results):
+            entry['inferenceMs'] = round(inference_ms, 2)
+            try:
+                start = time.perf_counter()
+                with timed('decode'):
+                    image = source.full_image()
+                with timed('compose'):
+                    result = compose_cutout(image, mask)
+                entry['composeMs'] = round((time.perf_counter() - start) * 1000, 2)
+                
+                start = time.perf_counter()
+                if encoder is None:
+                    encoded = encode_image(result, options)
+                else:
+                    encoded = encoder.submit(result, options)
+                pending.append((entry, start, encoded))
+            except Exception as e:
+                entry['error'] = str(e)
+        
+        for entry, start, encoded in pending:
+            try:
+                if encoder is not None:
+                    encoded = encoded.result()
+                STAGE_SECONDS.observe(time.perf_counter() - start, stage='encode')
+                entry['encodeMs'] = round((time.perf_counter() - start) * 1000, 2)
+                writer.add(entry['output'], encoded[0])
+            except Exception as e:
+                entry['error'] = str(e)
+    
+    try:
+        batch = []
+        for name, size, data in members:
+            entry = {'name': name, 'output': unique_output_name(name, options.extension, output_names)}
+            manifest.append(entry)
+            start = time.perf_counter()
+            try:
+                if data is None:
+                    # Over the byte budget by its header, so it was never decompressed
+                    intake.check_bytes(size)
+                # Only the header is read here
+                image = open_upload(data)
+                entry['width'], entry['height'] = image.size
+            except IntakeError as e:
+                entry['error'] = str(e)
+                continue
+            except Exception as e:
+                entry['error'] = f"Could not decode image: {e}"
+                continue
+            finally:
+                entry['decodeMs'] = round((time.perf_counter() - start) * 1000, 2)
+                del data
+            
+            batch.append((entry, image))
+            if len(batch) >= batch_size:
+                process_batch(batch)
+                batch = []
+                yield from writer.drain()
+        
+        if batch:
+            process_batch(batch)
+            batch = []
+        
+        if include_manifest:
+            writer.add('manifest.json', json.dumps({'images': manifest}, indent=2).encode('utf-8'))
+        writer.close()
+        yield from writer.drain()
+    finally:
+        archive_file.close()
+
+def requested_batch_size(value):
+    """Validate a 'batch' request value, returning the archive batch size"""
+    if value is None:
+        return max(1, args.archive_batch_size)
+    try:
+        batch_size = int(value)
+    except ValueError:
+        raise ValueError(f"Unsupported batch size: {value}")
+    if batch_size < 1:
+        raise ValueError(f"Unsupported batch size: {value}")
+    return batch_size
+
+@app.route('/remove-background/archive', methods=['POST'])
+def remove_background_archive():
+    """Remove backgrounds from every image in a zip/tar upload, streaming back a tar of cutouts"""
+    try:
+        try:
+            batch_size = requested_batch_size(request.args.get('batch'))
+            options = requested_encoding(request.args)
+        except ValueError as e:
+            return jsonify({'success': False, 'error': str(e)}), 400
+        if options.pil_format == 'JPEG':
+            return jsonify({'success': False, 'error': 'JPEG output requires an opaque background'}), 400
+        include_manifest = request.args.get('manifest', '1').lower() not in ('0', 'false', 'no')
+        
+        # Zip needs random access, so spool the upload (to disk once it gets large)
+        max_bytes = int(args.max_archive_mb * 1024 * 1024)
+        try:
+            if 'archive' in request.files:
+                archive_file = spool_stream(request.files['archive'].stream, max_bytes=max_bytes)
+            else:
+                archive_file = spool_stream(request.stream, max_bytes=max_bytes)
+        except RequestEntityTooLarge:
+            raise UploadTooLargeError(f"Archive is larger than the {args.max_archive_mb:g} MB limit")
+        
+        # Fail fast on uploads that aren't archives
+        if not zipfile.is_zipfile(archive_file):
+            archive_file.seek(0)
+            try:
+                tarfile.open(fileobj=archive_file, mode='r:*').close()
+            except tarfile.TarError:
+                archive_file.close()
+                return jsonify({'success': False, 'error': 'Upload is not a zip or tar archive'}), 400
+        archive_file.seek(0)
+        
+        logger.info("Processing archive for background removal...")
+        return Response(stream_with_context(archive_result_stream(archive_file, batch_size, include_manifest, options)),
+                        mimetype='application/x-tar',
+                        headers={'Content-Disposition': 'attachment; filename="results.tar"'})
+    
+    except IntakeError as e:
+        return intake_error_response(e)
+    except Exception as e:
+        logger.error(f"Error processing archive: {str(e)}")
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+# Asynchronous job queue, created by start_services unless --job-queue-size is 0
+job_queue = None
+
+def background_removal_job(image_bytes, image, options, refine=None, mask_size=None):
+    """Job body for /jobs: returns the encoded result and its metadata.
+    
+    image is the ImageSource opened (and counted) when the job was submitted.
+    """
+    encoded, mimetype, handle = run_background_removal(image_bytes, image, options, refine, mask_size)
+    return encoded, {'mimetype': mimetype, 'maskHandle': handle, 'maskSize': mask_size}
+
+@app.route('/jobs', methods=['POST'])
+def submit_job():
+    """Queue a background removal job (JSON base64, raw or multipart upload)"""
+    if job_queue is None:
+        return jsonify({'success': False, 'error': 'Job queue is disabled'}), 503
+    
+    try:
+        try:
+            mask_only = requested_output(request.args.get('output'))
+            options = requested_encoding(request.args, mask=mask_only)
+            refine = requested_refinement(request.args.get('refine'))
+        except ValueError as e:
+            return jsonify({'success': False, 'error': str(e)}), 400
+        
+        if options.pil_format == 'JPEG' and not mask_only:
+            return jsonify({'success': False, 'error': 'JPEG output requires an opaque background'}), 400
+        
+        if request.is_json:
+            check_json_upload_size()
+            data = request.json
+            if not data or 'image' not in data:
+                return jsonify({'success': False, 'error': 'No image provided'}), 400
+            image_data = data['image']
+            if image_data.startswith('data:image'):
+                # Remove the data:image/jpeg;base64, prefix
+                image_data = image_data.split(',')[1]
+            with timed('base64_decode'):
+                image_bytes = base64.b64decode(image_data)
+        else:
+            image_bytes = read_upload()
+        
+        # Reject bad or oversized uploads now rather than after they reach the front of the queue
+        try:
+            image = open_upload(image_bytes)
+        except UnidentifiedImageError:
+            return jsonify({'success': False, 'error': 'No valid image provided'}), 400
+        try:
+            mask_size = requested_mask_size(request.args.get('maskSize'), image.size) if mask_only else None
+        except ValueError as e:
+            return jsonify({'success': False, 'error': str(e)}), 400
+        
+        try:
+            job = job_queue.submit(background_removal_job, image_bytes, image, options, refine, mask_size)
+        except QueueFullError:
+            response = jsonify({'success': False, 'error': 'Server is busy, try again later'})
+            response.headers['Retry-After'] = '1'
+            return response, 429
+        
+        logger.info(f"Queued job {job.id}")
+        return jsonify({
+            'success': True,
+            'jobId': job.id,
+            'status': job.status,
+            'statusUrl': f"/jobs/{job.id}",
+            'resultUrl': f"/jobs/{job.id}/result"
+        }), 202
+    
+    except IntakeError as e:
+        return intake_error_response(e)
+    except Exception as e:
+        logger.error(f"Error submitting job: {str(e)}")
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def job_status(job_id):
+    """Job status and queue position"""
+    status = job_queue.status(job_id) if job_queue is not None else None
+    if status is None:
+        return jsonify({'success': False, 'error': 'Unknown or expired job'}), 404
+    return jsonify({'success': True, **status})
+
+@app.route('/jobs/<job_id>/result', methods=['GET'])
+def job_result(job_id):
+    """Fetch a finished job's image (binary, or a JSON data URL with ?as=json)"""
+    if job_queue is None:
+        return jsonify({'success': False, 'error': 'Unknown or expired job'}), 404
+    
+    status, data, info = job_queue.result(job_id)
+    if status is None:
+        return jsonify({'success': False, 'error': 'Unknown or expired job'}), 404
+    if status['status'] == FAILED:
+        return jsonify({'success': False, 'error': status.get('error', 'Job failed')}), 500
+    if data is None:
+        # Not finished yet
+        return jsonify({'success': False, **status}), 409
+    
+    mask_size = info.get('maskSize')
+    if request.args.get('as') == 'json':
+        with timed('base64_encode'):
+            img_str = base64.b64encode(data).decode('utf-8')
+        if mask_size:
+            return jsonify({
+                'success': True,
+                'maskUrl': f"data:{info['mimetype']};base64,{img_str}",
+                'width': mask_size[0],
+                'height': mask_size[1]
+            })
+        response = {
+            'success': True,
+            'processedImageUrl': f"data:{info['mimetype']};base64,{img_str}"
+        }
+        if info.get('maskHandle'):
+            response['maskHandle'] = info['maskHandle']
+        return jsonify(response)
+    
+    response = stream_bytes_response(data, info['mimetype'])
+    if info.get('maskHandle'):
+        response.headers['X-Mask-Handle'] = info['maskHandle']
+    if mask_size:
+        response.headers['X-Mask-Width'], response.headers['X-Mask-Height'] = map(str, mask_size)
+    return response
+
+def start_services(worker_index=None):
+    """Create the per-process batcher, result cache and mask store.
+    
+    Runs in every worker after the fork, since threads don't survive fork().
+    """
+    global batcher, result_cache, mask_store, job_queue, intake, encoder, worker_id
+    worker_id = worker_index
+    
+    # Upload limits and the in-flight memory budget (per process)
+    intake = ImageIntake(max_bytes=int(args.max_upload_mb * 1024 * 1024),
+                         max_pixels=int(args.max_megapixels * 1_000_000),
+                         allow_downscale=not args.no_downscale,
+                         memory_budget=int(args.memory_budget_mb * 1024 * 1024),
+                         wait_timeout=args.intake_wait)
+    
+    if args.torch_threads > 0:
+        torch.set_num_threads(args.torch_threads)
+    elif worker_index is not None:
+        # Forked workers get back the threads the parent gave up before forking,
+        # split between them so together they use the torch default
+        torch.set_num_threads(max(1, default_torch_threads // args.workers))
+    
+    # Pay compilation and allocator warmup before the first real request
+    warmup_model(net, args.warmup, sorted({1, args.batch_size}))
+    
+    # Share forward passes between concurrent requests
+    if args.batch_size > 1:
+        batcher = InferenceBatcher(lambda inputs: run_model(net, inputs),
+                                   max_batch_size=args.batch_size,
+                                   max_wait_ms=args.batch_wait_ms)
+        batcher.start()
+    
+    # Encode output images off the request threads
+    if args.encode_workers > 0:
+        encoder = ImageEncoder(max_workers=args.encode_workers)
+    
+    # Cache results of repeated uploads
+    if args.cache_size_mb > 0:
+        result_cache = ResultCache(max_memory_bytes=int(args.cache_size_mb * 1024 * 1024),
+                                   disk_dir=args.cache_dir,
+                                   max_disk_bytes=int(args.cache_disk_mb * 1024 * 1024))
+    
+    # Keep originals and masks so backgrounds can be swapped by handle
+    if args.mask_store_mb > 0:
+        mask_store = MaskStore(ttl_seconds=args.mask_ttl,
+                               max_bytes=int(args.mask_store_mb * 1024 * 1024),
+                               shared_dir=args.mask_store_dir)
+    
+    # Bounded queue behind the asynchronous /jobs API
+    if args.job_queue_size > 0:
+        job_queue = JobQueue(max_queued=args.job_queue_size,
+                             num_workers=args.job_workers,
+                             result_ttl=args.job_ttl,
+                             shared_dir=args.job_dir)
+        job_queue.start()
+    
+    # Let whichever worker answers /metrics report every worker
+    if args.metrics_dir and worker_index is not None:
+        metrics.start_publishing(args.metrics_dir, worker_index)
+
+def stop_services():
+    """Stop the batcher and drain the encoder pool of an exiting worker"""
+    if batcher is not None:
+        batcher.stop()
+    if encoder is not None:
+        encoder.shutdown()
+
+def create_shared_dirs():
+    """Point mask handles, job results and metrics at directories every worker can see.
+    
+    Returns the directories created here, which are removed when the server exits.
+    """
+    shm_root = '/dev/shm' if os.path.isdir('/dev/shm') else None
+    owned_dirs = []
+    if args.mask_store_mb > 0 and args.mask_store_dir is None:
+        args.mask_store_dir = tempfile.mkdtemp(prefix='u2net-masks-', dir=shm_root)
+        owned_dirs.append(args.mask_store_dir)
+    if args.job_queue_size > 0 and args.job_dir is None:
+        args.job_dir = tempfile.mkdtemp(prefix='u2net-jobs-', dir=shm_root)
+        owned_dirs.append(args.job_dir)
+    if args.metrics_dir is None:
+        args.metrics_dir = tempfile.mkdtemp(prefix='u2net-metrics-', dir=shm_root)
+        owned_dirs.append(args.metrics_dir)
+    return owned_dirs
+
+def remove_shared_dirs(owned_dirs, owner_pid):
+    # Forked workers inherit atexit handlers; only the process that made the directories removes them
+    if os.getpid() == owner_pid:
+        for path in owned_dirs:
+            shutil.rmtree(path, ignore_errors=True)
+
+def create_app(argv=None):
+    """Load the model and return the app, ready for start_services in each serving process.
+    
+    argv replaces the command line arguments (e.g. ['--model', 'u2netp']) when
+    the server is embedded. Raises RuntimeError if the model can't be loaded.
+    """
+    global args, net, raw_input
+    if argv is not None:
+        args = parser.parse_args(argv)
+    if net is not None:
+        return app
+    
     logger.info(f"Loading {args.model} model...")
-    net = load_model(args.model)
-    if net is None:
-        logger.error("Failed to load model. Exiting.")
-        sys.exit(1)
+    model = load_model(args.model)
+    if model is None:
+        raise RuntimeError("Failed to load model")
     
     logger.info("Model loaded successfully!")
-    logger.info(f"Starting Flask server on http://{args.host}:{args.port}")
+    
+    if args.fuse and isinstance(model, torch.nn.Module):
+        fused = fuse_model(model)
+        parity = fusion_parity(model, fused)
+        if parity > 1e-3:
+            raise RuntimeError(f"Fused model differs from the original by {parity:.2e}")
+        logger.info(f"Fused BatchNorm and input normalization (max difference {parity:.2e})")
+        model, raw_input = fused, True
+    elif args.fuse:
+        logger.info("Ignoring --fuse for a quantized model")
+    
+    if args.workers > 1 or args.server == 'gunicorn':
+        # Keep the parent single-threaded: forking after torch has started its
+        # OpenMP pool can deadlock the workers
+        torch.set_num_threads(1)
+    net = compile_model(model, args.model, args.backend,
+                        intra_op_threads=args.ort_intra_threads,
+                        inter_op_threads=args.ort_inter_threads)
+    
+    # Refuse bodies over the largest upload any endpoint takes before they are read;
+    # limit_request_body lowers this per endpoint
+    limits = [body_limit(None), body_limit('remove_background_archive')]
+    app.config['MAX_CONTENT_LENGTH'] = None if None in limits else max(limits)
     
     # Set up caching and compression for production
     if PRODUCTION:
         from flask_compress import Compress
-        Compress(app)
+        app.config['COMPRESS_REGISTER'] = False
+        compress = Compress(app)
         
-    app.run(host=args.host, port=args.port, debug=args.debug, threaded=True) 
\ No newline at end of file
+        @app.after_request
+        def compress_response(response):
+            # Base64 image payloads are already compressed by the image encoder
+            if request.endpoint in PRECOMPRESSED_ENDPOINTS:
+                return response
+            return compress.after_request(response)
+    
+    if args.workers > 1:
+        # Handles must be visible to every worker, so spill them to a shared directory
+        # (job status and results likewise)
+        atexit.register(remove_shared_dirs, create_shared_dirs(), os.getpid())
+    
+    return app
+
+if __name__ == '__main__':
+    try:
+        create_app()
+    except RuntimeError as e:
+        logger.error(f"{e}. Exiting.")
+        sys.exit(1)
+    
+    if args.server == 'gunicorn':
+        try:
+            from gunicorn_server import GunicornServer, bind_address
+        except ImportError:
+            logger.error("--server gunicorn needs gunicorn: pip install gunicorn")
+            sys.exit(1)
+        
+        GunicornServer(app, {
+            'bind': bind_address(args.host, args.port),
+            'workers': args.workers,
+            'worker_class': 'gthread',
+            'threads': args.threads,
+            'timeout': args.timeout,
+            'graceful_timeout': args.graceful_timeout,
+            'keepalive': args.keepalive,
+            'loglevel': 'debug' if args.debug else 'info',
+        }, init_worker=start_services, stop_worker=stop_services).run()
+    elif args.workers > 1:
+        logger.info(f"Starting {args.workers} pre-forked workers on http://{args.host}:{args.port}")
+        server = PreforkServer(app, args.host, args.port, args.workers,
+                               init_worker=start_services,
+                               rss_report_interval=args.rss_report_interval)
+        server.serve_forever()
+    else:
+        start_services()
+        logger.info(f"Starting Flask server on http://{args.host}:{args.port}")
+        app.run(host=args.host, port=args.port, debug=args.debug, threaded=True)